@@ -0,0 +1,78 @@
+"""
+Заглушка Elasticsearch для замеров: принимает _bulk с заданной
+задержкой и считает документы и байты. Запускается в отдельном
+процессе, чтобы не делить event loop и CPU с измеряемым ETL.
+"""
+import asyncio
+import multiprocessing
+import time
+
+from aiohttp import web
+
+VERSION = {"version": {"number": "7.7.0"}, "tagline": "You Know, for Search"}
+
+
+class FakeElastic:
+    """
+    :param latency: задержка ответа на каждый _bulk в секундах
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.indices: set[str] = set()
+        self.stats = {"requests": 0, "documents": 0, "bytes": 0}
+
+    def application(self) -> web.Application:
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_get("/_bench/stats", self.get_stats)
+        app.router.add_route("*", "/", self.info)
+        app.router.add_post("/{index}/_bulk", self.bulk)
+        app.router.add_route("HEAD", "/{index}", self.index_exists)
+        app.router.add_put("/{index}", self.create_index)
+        return app
+
+    async def info(self, request: web.Request) -> web.Response:
+        return web.json_response(VERSION)
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    async def index_exists(self, request: web.Request) -> web.Response:
+        exists = request.match_info["index"] in self.indices
+        return web.Response(status=200 if exists else 404)
+
+    async def create_index(self, request: web.Request) -> web.Response:
+        self.indices.add(request.match_info["index"])
+        return web.json_response({"acknowledged": True})
+
+    async def bulk(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.stats["requests"] += 1
+        self.stats["documents"] += body.count(b"\n") // 2
+        self.stats["bytes"] += len(body)
+        # Ответ с учётом filter_path=errors,items.*._id,items.*.error
+        return web.json_response({"errors": False})
+
+
+def serve(port: int, latency: float) -> None:
+    web.run_app(
+        FakeElastic(latency).application(),
+        host="127.0.0.1",
+        port=port,
+        print=None,
+        access_log=None,
+    )
+
+
+def start_fake_elastic(
+    port: int = 9299, latency: float = 0.0
+) -> multiprocessing.Process:
+    """Процесс заглушки; остановка - process.terminate()"""
+    process = multiprocessing.Process(
+        target=serve, args=(port, latency), daemon=True
+    )
+    process.start()
+    time.sleep(0.5)
+    return process
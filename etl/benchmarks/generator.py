@@ -0,0 +1,184 @@
+"""
+Генератор синтетического каталога для content.* с фиксированным seed.
+Строки пишутся через COPY частями по chunk_size, поэтому каталог
+на миллионы фильмов не собирается в памяти целиком.
+"""
+import csv
+import io
+import random
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator
+
+from psycopg2.extensions import connection as pg_connection
+
+ROLES = ("actor", "director", "writer")
+BASE_TIME = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+# Столбцы таблиц админки, которые заполняет генератор
+TABLE_COLUMNS = {
+    "genre": ("id", "name", "description", "created", "modified"),
+    "person": ("id", "full_name", "created", "modified"),
+    "film_work": (
+        "id", "title", "description", "creation_date", "rating", "type",
+        "created", "modified",
+    ),
+    "genre_film_work": ("id", "film_work_id", "genre_id", "created"),
+    "person_film_work": (
+        "id", "film_work_id", "person_id", "role", "created",
+    ),
+}
+TRUNCATE_QUERY = (
+    "TRUNCATE content.person_film_work, content.genre_film_work, "
+    "content.film_work, content.person, content.genre;"
+)
+
+
+@dataclass
+class CatalogScale:
+    films: int = 10_000
+    persons: int = 5_000
+    genres: int = 30
+    persons_per_film: int = 6
+    genres_per_film: int = 2
+
+
+class CatalogGenerator:
+    """
+    Детерминированный каталог: при одинаковых seed и scale
+    получаются одни и те же id, названия и связи.
+    """
+
+    def __init__(self, scale: CatalogScale, seed: int = 42):
+        self.scale = scale
+        self.seed = seed
+
+    def _uuid(self, rng: random.Random) -> str:
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    def _ids(self, table: str, amount: int) -> list[str]:
+        rng = random.Random(f"{self.seed}-{table}")
+        return [self._uuid(rng) for _ in range(amount)]
+
+    @property
+    def genre_ids(self) -> list[str]:
+        return self._ids("genre", self.scale.genres)
+
+    @property
+    def person_ids(self) -> list[str]:
+        return self._ids("person", self.scale.persons)
+
+    def genres(self) -> Iterator[tuple]:
+        for number, genre_id in enumerate(self.genre_ids):
+            created = BASE_TIME + timedelta(minutes=number)
+            yield genre_id, f"Genre {number}", None, created, created
+
+    def persons(self) -> Iterator[tuple]:
+        for number, person_id in enumerate(self.person_ids):
+            created = BASE_TIME + timedelta(seconds=number)
+            yield person_id, f"Person {number}", created, created
+
+    def films(self) -> Iterator[tuple[tuple, list[tuple], list[tuple]]]:
+        """Фильм вместе со строками связей с жанрами и персонами"""
+        rng = random.Random(f"{self.seed}-film_work")
+        genre_ids, person_ids = self.genre_ids, self.person_ids
+        for number in range(self.scale.films):
+            film_id = self._uuid(rng)
+            created = BASE_TIME + timedelta(seconds=number)
+            film = (
+                film_id,
+                f"Film {number}",
+                f"Synthetic description {number} " * rng.randint(1, 8),
+                (BASE_TIME - timedelta(days=rng.randint(0, 36500))).date(),
+                round(rng.uniform(1, 10), 1),
+                "movie",
+                created,
+                created,
+            )
+            genres = [
+                (self._uuid(rng), film_id, genre_id, created)
+                for genre_id in rng.sample(
+                    genre_ids, min(self.scale.genres_per_film, len(genre_ids))
+                )
+            ]
+            persons = [
+                (
+                    self._uuid(rng),
+                    film_id,
+                    person_id,
+                    rng.choice(ROLES),
+                    created,
+                )
+                for person_id in rng.sample(
+                    person_ids,
+                    min(self.scale.persons_per_film, len(person_ids)),
+                )
+            ]
+            yield film, genres, persons
+
+    def load(
+        self,
+        connection: pg_connection,
+        truncate: bool = False,
+        chunk_size: int = 50_000,
+    ) -> dict[str, int]:
+        """Запись каталога в postgres, возвращает число строк по таблицам"""
+        with connection.cursor() as cursor:
+            if truncate:
+                cursor.execute(TRUNCATE_QUERY)
+            counts = {
+                "genre": copy_rows(cursor, "genre", self.genres(), chunk_size),
+                "person": copy_rows(
+                    cursor, "person", self.persons(), chunk_size
+                ),
+            }
+            films, genre_links, person_links = [], [], []
+            counts.update(dict.fromkeys(
+                ("film_work", "genre_film_work", "person_film_work"), 0
+            ))
+            for film, genres, persons in self.films():
+                films.append(film)
+                genre_links.extend(genres)
+                person_links.extend(persons)
+                if len(films) >= chunk_size:
+                    self._flush(
+                        cursor, counts, films, genre_links, person_links
+                    )
+            self._flush(cursor, counts, films, genre_links, person_links)
+        connection.commit()
+        return counts
+
+    @staticmethod
+    def _flush(cursor, counts, films, genre_links, person_links) -> None:
+        # Фильмы пишутся раньше связей из-за внешних ключей
+        for table, rows in (
+            ("film_work", films),
+            ("genre_film_work", genre_links),
+            ("person_film_work", person_links),
+        ):
+            counts[table] += copy_rows(cursor, table, rows, len(rows) or 1)
+            rows.clear()
+
+
+def copy_rows(
+    cursor, table: str, rows: Iterable[tuple], chunk_size: int
+) -> int:
+    """COPY ... FROM STDIN частями по chunk_size строк"""
+    columns = ", ".join(TABLE_COLUMNS[table])
+    query = f"COPY content.{table} ({columns}) FROM STDIN WITH (FORMAT csv)"
+    total = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+        total += 1
+        if total % chunk_size == 0:
+            buffer.seek(0)
+            cursor.copy_expert(query, buffer)
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        buffer.seek(0)
+        cursor.copy_expert(query, buffer)
+    return total
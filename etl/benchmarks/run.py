@@ -0,0 +1,219 @@
+"""
+Замеры ETL на синтетическом каталоге и заглушке Elasticsearch.
+
+    python -m benchmarks.run --generate --films 100000 --scenario all \
+        --output bench.json --baseline baseline.json
+
+Postgres берётся из .env, Elasticsearch подменяется заглушкой,
+состояние ETL пишется во временный файл. Для каждого сценария
+выводятся документы в секунду, пиковый RSS процесса и суммарное
+время этапов extract, transform и load (bulk) по индексам.
+"""
+import argparse
+import asyncio
+import json
+import resource
+import tempfile
+import time
+from contextlib import AsyncExitStack
+from pathlib import Path
+
+import psycopg2
+from prometheus_client import REGISTRY
+
+from benchmarks.fake_elastic import start_fake_elastic
+from benchmarks.generator import CatalogGenerator, CatalogScale
+from components.config import AppSettings
+from components.metrics import STAGE_BULK, STAGE_EXTRACT, STAGE_TRANSFORM
+from components.storage import JsonFileStorage, State
+from main import create_transform_pool, open_etl
+
+SCENARIOS = ("full", "delta", "rename")
+STAGES = {
+    "extract": STAGE_EXTRACT,
+    "transform": STAGE_TRANSFORM,
+    "load": STAGE_BULK,
+}
+
+# Детерминированная выборка: порядок по хэшу id с seed
+DELTA_QUERY = """
+UPDATE content.film_work SET modified = NOW()
+WHERE id IN (
+    SELECT id FROM content.film_work
+    ORDER BY md5(id::text || %(seed)s) LIMIT %(limit)s
+);
+"""
+RENAME_QUERY = """
+UPDATE content.person SET full_name = full_name || ' *', modified = NOW()
+WHERE id IN (
+    SELECT person_id FROM content.person_film_work
+    GROUP BY person_id
+    ORDER BY COUNT(*) DESC, person_id LIMIT %(limit)s
+);
+"""
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Замеры ETL")
+    parser.add_argument(
+        "--scenario", choices=(*SCENARIOS, "all"), default="all"
+    )
+    parser.add_argument("--generate", action="store_true",
+                        help="пересоздать каталог в content.* (TRUNCATE)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--films", type=int, default=10_000)
+    parser.add_argument("--persons", type=int, default=5_000)
+    parser.add_argument("--genres", type=int, default=30)
+    parser.add_argument("--persons-per-film", type=int, default=6)
+    parser.add_argument("--genres-per-film", type=int, default=2)
+    parser.add_argument("--delta", type=int, default=1_000,
+                        help="сколько фильмов изменить в сценарии delta")
+    parser.add_argument("--renames", type=int, default=10,
+                        help="сколько персон переименовать в сценарии rename")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="задержка ответа заглушки на _bulk, сек.")
+    parser.add_argument("--port", type=int, default=9299)
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--baseline", type=Path)
+    return parser.parse_args()
+
+
+def stage_snapshot(settings: AppSettings) -> dict:
+    snapshot = {}
+    for model_params in settings.etl_models:
+        index = model_params.index_name
+        snapshot[index] = {
+            "documents": REGISTRY.get_sample_value(
+                "etl_documents_loaded_total", {"index": index}
+            ) or 0,
+            **{
+                name: REGISTRY.get_sample_value(
+                    "etl_stage_duration_seconds_sum",
+                    {"index": index, "stage": stage},
+                ) or 0
+                for name, stage in STAGES.items()
+            },
+        }
+    return snapshot
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux - килобайты
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+async def measure(name: str, etl, settings: AppSettings) -> dict:
+    before = stage_snapshot(settings)
+    start = time.perf_counter()
+    await etl.start_pipeline()
+    duration = time.perf_counter() - start
+    after = stage_snapshot(settings)
+    indices = {
+        index: {
+            key: round(after[index][key] - before[index][key], 3)
+            for key in after[index]
+        }
+        for index in after
+    }
+    documents = sum(stats["documents"] for stats in indices.values())
+    return {
+        "scenario": name,
+        "seconds": round(duration, 3),
+        "documents": documents,
+        "documents_per_second": round(documents / duration, 1),
+        "peak_rss_mb": peak_rss_mb(),
+        "indices": indices,
+    }
+
+
+def execute(settings: AppSettings, query: str, params: dict) -> None:
+    with psycopg2.connect(settings.pg_settings.pg_dsn) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+    connection.close()
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    state_file = Path(tempfile.mkdtemp(prefix="etl-bench-"), "state.json")
+    settings = AppSettings(storage=State(JsonFileStorage(state_file)))
+    settings.es_settings.host = "127.0.0.1"
+    settings.es_settings.port = args.port
+    if args.generate:
+        connection = psycopg2.connect(settings.pg_settings.pg_dsn)
+        counts = CatalogGenerator(
+            CatalogScale(
+                films=args.films,
+                persons=args.persons,
+                genres=args.genres,
+                persons_per_film=args.persons_per_film,
+                genres_per_film=args.genres_per_film,
+            ),
+            seed=args.seed,
+        ).load(connection, truncate=True)
+        connection.close()
+        print(f"Каталог: {counts}")
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    reports = []
+    transform_pool = create_transform_pool(settings)
+    async with AsyncExitStack() as stack:
+        etl = await open_etl(stack, settings, transform_pool)
+        # Инкрементальным сценариям нужна выгрузка с нуля до замера
+        full = await measure("full", etl, settings)
+        if "full" in scenarios:
+            reports.append(full)
+        if "delta" in scenarios:
+            execute(
+                settings,
+                DELTA_QUERY,
+                {"seed": str(args.seed), "limit": args.delta},
+            )
+            reports.append(await measure("delta", etl, settings))
+        if "rename" in scenarios:
+            execute(settings, RENAME_QUERY, {"limit": args.renames})
+            reports.append(await measure("rename", etl, settings))
+    if transform_pool:
+        transform_pool.shutdown()
+    return reports
+
+
+def print_reports(reports: list[dict], baseline: list[dict] | None) -> None:
+    baseline = {report["scenario"]: report for report in baseline or []}
+    for report in reports:
+        line = (
+            f"{report['scenario']:>7}: {report['documents']} док. "
+            f"за {report['seconds']} сек., "
+            f"{report['documents_per_second']} док./сек., "
+            f"RSS {report['peak_rss_mb']} МБ"
+        )
+        previous = baseline.get(report["scenario"])
+        if previous and previous["documents_per_second"]:
+            change = (
+                report["documents_per_second"]
+                / previous["documents_per_second"] - 1
+            ) * 100
+            line += f" ({change:+.1f}% к базовому замеру)"
+        print(line)
+        for index, stats in report["indices"].items():
+            stages = ", ".join(f"{name} {stats[name]} сек." for name in STAGES)
+            print(f"         {index}: {stats['documents']} док., {stages}")
+
+
+def main() -> None:
+    args = parse_args()
+    fake_elastic = start_fake_elastic(port=args.port, latency=args.latency)
+    try:
+        reports = asyncio.run(run(args))
+    finally:
+        fake_elastic.terminate()
+    baseline = (
+        json.loads(args.baseline.read_text()) if args.baseline else None
+    )
+    print_reports(reports, baseline)
+    if args.output:
+        args.output.write_text(
+            json.dumps(reports, ensure_ascii=False, indent=2)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,139 @@
+import asyncio
+import gzip
 from http import HTTPStatus
+from typing import Any, Iterable, Iterator
 
-from elasticsearch import (AsyncElasticsearch, Elasticsearch, exceptions,
-                           helpers)
+import aiohttp
+import orjson
+from elasticsearch import (
+    AIOHttpConnection,
+    AsyncElasticsearch,
+    Elasticsearch,
+    exceptions,
+)
+from elasticsearch._async.http_aiohttp import ESClientResponse
+from elasticsearch.serializer import JSONSerializer
 from pydantic import AnyHttpUrl
 
 from clients.base_client import AbstractClient
-from components.backoff import backoff
-from components.backoff import reconnect as client_reconnect
+from components.backoff import (
+    CircuitBreaker,
+    CircuitOpenError,
+    async_backoff,
+    backoff,
+    circuit,
+)
 from components.logger import logger
 
 PING_MESSAGE = "Подключение к Elasticsearch: {message}"
+FORCEMERGE_TIMEOUT = 60 * 60
+# Из ответа _bulk нужны только ошибки, успешная операция
+# приходит как {"index": {"_id": ...}}
+BULK_FILTER_PATH = "errors,items.*._id,items.*.error"
 CONNECTION_FAIL = (
     "Соединение для {client} клиента Elasticsearch не установлено"
 )
 
 
+class OrjsonSerializer(JSONSerializer):
+    """Сериализатор на orjson, готовые str и bytes передаются как есть"""
+
+    def dumps(self, data: Any) -> str | bytes:
+        if isinstance(data, (str, bytes)):
+            return data
+        try:
+            return orjson.dumps(data, default=self.default).decode()
+        except TypeError as error:
+            raise exceptions.SerializationError(data, error)
+
+    def loads(self, s: str | bytes) -> Any:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError as error:
+            raise exceptions.SerializationError(s, error)
+
+
+class KeepAliveConnection(AIOHttpConnection):
+    """
+    Соединение aiohttp с настраиваемым временем жизни простаивающих
+    сокетов: по умолчанию aiohttp закрывает их через 15 секунд.
+    AIOHttpConnection не принимает параметры TCPConnector, поэтому
+    переопределён закрытый _create_aiohttp_session elasticsearch-py
+    7.8.0; версия зафиксирована в requirements.txt и при обновлении
+    метод нужно сверить с новой реализацией.
+    :param keepalive_timeout: время жизни простаивающего сокета
+    """
+
+    def __init__(self, *args, keepalive_timeout: float = 15, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.keepalive_timeout = keepalive_timeout
+
+    async def _create_aiohttp_session(self) -> None:
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        self.session = aiohttp.ClientSession(
+            headers=self.headers,
+            auto_decompress=True,
+            loop=self.loop,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            response_class=ESClientResponse,
+            connector=aiohttp.TCPConnector(
+                limit=self._limit,
+                use_dns_cache=True,
+                ssl=self._ssl_context,
+                keepalive_timeout=self.keepalive_timeout,
+            ),
+        )
+
+
+def ndjson_bulk_chunks(
+    documents: Iterable[tuple[str, dict | str]],
+    max_bytes: int | None = None,
+    action_type: str = "index",
+) -> Iterator[tuple[bytes, int]]:
+    """
+    Тела запросов _bulk из пар (id, документ) не больше max_bytes байт;
+    документ больше лимита уходит отдельным запросом.
+    Словарь кодируется orjson, json-текст режима passthrough
+    вставляется без разбора.
+    :param action_type: index - документ целиком, update - тело
+        частичного обновления ({"script": ...} или {"doc": ...})
+    :return: тело запроса и количество документов в нём
+    """
+    lines, size, count = [], 0, 0
+    for doc_id, source in documents:
+        action = orjson.dumps({action_type: {"_id": doc_id}})
+        body = (
+            source.encode() if isinstance(source, str) else orjson.dumps(source)
+        )
+        item_size = len(action) + len(body) + 2
+        if lines and max_bytes and size + item_size > max_bytes:
+            yield b"".join(lines), count
+            lines, size, count = [], 0, 0
+        lines.extend((action, b"\n", body, b"\n"))
+        size += item_size
+        count += 1
+    if lines:
+        yield b"".join(lines), count
+
+
 class ElasticsearchClient(AbstractClient):
     base_exceptions = exceptions.ConnectionError
     _connection = Elasticsearch
 
-    def __init__(self, dsn: AnyHttpUrl, *args, **kwargs):
+    def __init__(
+        self,
+        dsn: AnyHttpUrl,
+        *args,
+        breaker: CircuitBreaker | None = None,
+        **kwargs,
+    ):
+        """
+        Запросы к индексам проходят через breaker, без ping перед
+        каждым запросом; вызывать их нужно из пула потоков.
+        :param breaker: размыкатель, общий с асинхронным клиентом
+        """
+        self.breaker = breaker or CircuitBreaker(name=self.__class__.__name__)
         super().__init__(dsn, *args, **kwargs)
 
     @property
@@ -36,10 +150,11 @@ class ElasticsearchClient(AbstractClient):
         """Клиент ленивый - нужен явный запрос на ping"""
         logger.info("Попытка подключения к Elasticsearch")
         self._connection = Elasticsearch(self.dsn, *self.args, **self.kwargs)
-        if not self.is_connected:
+        connected = self.is_connected
+        if not connected:
             logger.exception(CONNECTION_FAIL.format("синхронного"))
             raise self.base_exceptions(CONNECTION_FAIL.format("синхронного"))
-        logger.info(PING_MESSAGE.format(message=self._connection.ping()))
+        logger.info(PING_MESSAGE.format(message=connected))
 
     @backoff(exceptions=(base_exceptions,))
     def close(self) -> None:
@@ -54,7 +169,7 @@ class ElasticsearchClient(AbstractClient):
             exceptions.RequestError,
         )
     )
-    @client_reconnect
+    @circuit
     def index_exists(self, index: str) -> bool:
         return self._connection.indices.exists(index=index)
 
@@ -64,7 +179,7 @@ class ElasticsearchClient(AbstractClient):
             exceptions.SerializationError,
         )
     )
-    @client_reconnect
+    @circuit
     def index_create(self, index: str, body: dict):
         return self._connection.indices.create(
             index=index,
@@ -72,26 +187,115 @@ class ElasticsearchClient(AbstractClient):
             ignore=HTTPStatus.BAD_REQUEST.value,
         )
 
-    def create_index_if_not_exists(self, index_name, index_schema) -> None:
-        if not self.index_exists(index=index_name):
-            response = self.index_create(
-                index=index_name,
-                body=index_schema,
-            )
-            logger.debug(
-                f"Индекс {index_name} создан. "
-                f"Ответ Elasticsearch: {response}"
-            )
+    def create_index_if_not_exists(self, index_name, index_schema) -> bool:
+        """True - индекс создан этим вызовом"""
+        if self.index_exists(index=index_name):
+            return False
+        response = self.index_create(
+            index=index_name,
+            body=index_schema,
+        )
+        logger.debug(
+            f"Индекс {index_name} создан. "
+            f"Ответ Elasticsearch: {response}"
+        )
+        return True
+
+    @backoff(exceptions=(base_exceptions,))
+    @circuit
+    def put_script(self, script_id: str, source: str) -> dict:
+        return self._connection.put_script(
+            id=script_id,
+            body={"script": {"lang": "painless", "source": source}},
+        )
+
+    @backoff(exceptions=(base_exceptions,))
+    @circuit
+    def get_indices(self, pattern: str) -> list[str]:
+        return list(self._connection.indices.get(index=pattern))
+
+    @backoff(exceptions=(base_exceptions,))
+    @circuit
+    def get_alias_indices(self, alias: str) -> list[str]:
+        response = self._connection.indices.get_alias(
+            name=alias, ignore=HTTPStatus.NOT_FOUND.value
+        )
+        # При 404 в ответе только поля error и status
+        return [
+            index
+            for index, body in response.items()
+            if isinstance(body, dict) and "aliases" in body
+        ]
+
+    @backoff(exceptions=(base_exceptions,))
+    @circuit
+    def update_settings(self, index: str, body: dict) -> dict:
+        return self._connection.indices.put_settings(index=index, body=body)
+
+    @backoff(exceptions=(base_exceptions,))
+    @circuit
+    def refresh(self, index: str) -> dict:
+        return self._connection.indices.refresh(index=index)
+
+    @backoff(exceptions=(base_exceptions,))
+    @circuit
+    def forcemerge(self, index: str, max_num_segments: int = 1) -> dict:
+        return self._connection.indices.forcemerge(
+            index=index,
+            max_num_segments=max_num_segments,
+            request_timeout=FORCEMERGE_TIMEOUT,
+        )
+
+    @backoff(exceptions=(base_exceptions,))
+    @circuit
+    def swap_alias(
+        self, alias: str, index: str, old_indices: list[str]
+    ) -> dict:
+        """
+        Атомарное переключение псевдонима на index. Если вместо
+        псевдонима существует обычный индекс с тем же именем,
+        он удаляется тем же запросом.
+        """
+        actions = [
+            {"remove_index": {"index": alias}}
+            if old_index == alias
+            else {"remove": {"index": old_index, "alias": alias}}
+            for old_index in old_indices
+        ]
+        actions.append({"add": {"index": index, "alias": alias}})
+        return self._connection.indices.update_aliases(
+            body={"actions": actions}
+        )
+
+    @backoff(exceptions=(base_exceptions,))
+    @circuit
+    def delete_index(self, index: str) -> dict:
+        return self._connection.indices.delete(
+            index=index, ignore=HTTPStatus.NOT_FOUND.value
+        )
 
 
 class ElasticsearchAsyncClient:
     base_exceptions = exceptions.ConnectionError
     _connection = AsyncElasticsearch
 
-    def __init__(self, dsn, *args, **kwargs):
+    def __init__(
+        self,
+        dsn,
+        *args,
+        breaker: CircuitBreaker | None = None,
+        compression_level: int = 0,
+        **kwargs,
+    ):
+        """
+        :param compression_level: уровень gzip для тел _bulk, 0 - без сжатия
+        """
         self.dsn = dsn
+        self.compression_level = compression_level
         self.args = args
         self.kwargs = kwargs
+        self.breaker = breaker or CircuitBreaker(name=self.__class__.__name__)
+        self.kwargs.setdefault("serializer", OrjsonSerializer())
         self._connection = AsyncElasticsearch(
             self.dsn, *self.args, **self.kwargs
         )
@@ -101,17 +305,52 @@ class ElasticsearchAsyncClient:
         return self._connection and await self._connection.ping()
 
     async def close(self) -> None:
-        if await self.is_connected:
+        if self._connection:
             await self._connection.close()
             logger.info(f"Соединение закрыто для {self.__class__.__name__}")
         self._connection = None
 
-    async def bulk(self, *args, **kwargs) -> tuple:
-        """Клиент ленивый - нужен явный запрос на ping"""
-        if not await self.is_connected:
-            logger.exception(CONNECTION_FAIL.format("асинхронного"))
-            raise self.base_exceptions(CONNECTION_FAIL.format("асинхронного"))
-        success, errors = await helpers.async_bulk(
-            client=self._connection, *args, **kwargs
+    async def compress(self, body: bytes) -> bytes:
+        """
+        Сжатие тела _bulk, если оно включено. zlib отпускает GIL,
+        поэтому сжатие в пуле потоков не блокирует event loop.
+        """
+        if not self.compression_level:
+            return body
+        return await asyncio.get_running_loop().run_in_executor(
+            None, gzip.compress, body, self.compression_level
+        )
+
+    @async_backoff(exceptions=(base_exceptions, CircuitOpenError))
+    @circuit
+    async def bulk_ndjson(
+        self, body: bytes, index: str, count: int
+    ) -> tuple[int, list]:
+        """
+        Отправка готового тела _bulk без сборки документов клиентом.
+        Ответ урезан filter_path до items.*._id и items.*.error:
+        ошибки - элементы items с ошибкой,
+        {"<операция>": {"_id": ..., "error": {...}}}.
+        :param body: тело запроса после compress, см. ndjson_bulk_chunks
+        :param index: индекс операций тела
+        :param count: количество документов в теле
+        """
+        response = await self._connection.transport.perform_request(
+            "POST",
+            f"/{index}/_bulk",
+            params={"filter_path": BULK_FILTER_PATH},
+            body=body,
+            headers=(
+                {"content-encoding": "gzip"}
+                if self.compression_level
+                else None
+            ),
         )
-        return success, set(errors)
+        if not response.get("errors"):
+            return count, []
+        errors = [
+            item
+            for item in response["items"]
+            if any("error" in operation for operation in item.values())
+        ]
+        return count - len(errors), errors
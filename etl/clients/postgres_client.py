@@ -1,22 +1,28 @@
 from __future__ import annotations
 
+import asyncio
 import contextlib
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Iterator
 
 import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ
 from psycopg2.extensions import connection as pg_coon
 from psycopg2.extensions import cursor as pg_cursor
-from psycopg2.sql import SQL
+from psycopg2.sql import SQL, Identifier
 from pydantic import PostgresDsn
 
 from clients.base_client import AbstractClient, AbstractClientInterface
 from components.backoff import backoff
+from components.backoff import reconnect as client_reconnect
 from components.logger import logger
 
 
 class PostgresClient(AbstractClient):
     base_exceptions = psycopg2.OperationalError
     _connection = pg_coon
+    _in_snapshot = False
 
     def __init__(self, dsn: PostgresDsn, *args, **kwargs):
         super().__init__(dsn, *args, **kwargs)
@@ -35,12 +41,50 @@ class PostgresClient(AbstractClient):
 
     @backoff(exceptions=(base_exceptions,))
     @contextlib.contextmanager
-    def cursor(self) -> "PostgresCursor":
-        cursor: PostgresCursor = PostgresCursor(self)
-
-        yield cursor
+    def cursor(
+        self, name: str | None = None, itersize: int | None = None
+    ) -> "PostgresCursor":
+        """
+        Курсор postgres.
+        :param name: имя серверного курсора, None - клиентский курсор,
+            который забирает весь результат запроса в память ETL
+        :param itersize: сколько строк серверный курсор забирает
+            за один сетевой запрос при итерации
+        """
+        cursor: PostgresCursor = PostgresCursor(
+            self, name=name, itersize=itersize
+        )
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+            if self.is_connected and not self._in_snapshot:
+                # Завершаем транзакцию чтения, чтобы не держать vacuum
+                self._connection.commit()
 
-        cursor.close()
+    @contextlib.contextmanager
+    def snapshot(self) -> Iterator[None]:
+        """
+        Одна транзакция REPEATABLE READ READ ONLY на все курсоры
+        внутри блока: запросы видят один снимок данных, и изменение,
+        закоммиченное между ними, не теряется. Транзакция
+        завершается при выходе из блока.
+        """
+        connection = self._connection
+        isolation_level = connection.isolation_level
+        readonly = connection.readonly
+        connection.isolation_level = ISOLATION_LEVEL_REPEATABLE_READ
+        connection.readonly = True
+        self._in_snapshot = True
+        try:
+            yield
+        finally:
+            self._in_snapshot = False
+            if not connection.closed:
+                # None возвращает настройки сервера по умолчанию
+                connection.commit()
+                connection.isolation_level = isolation_level
+                connection.readonly = readonly
 
     def reconnect(self) -> None:
         super().reconnect()
@@ -50,13 +94,83 @@ class PostgresClient(AbstractClient):
         super().close()
 
 
+class PostgresListener(PostgresClient):
+    """
+    Отдельное соединение в режиме autocommit с LISTEN на канал.
+    Уведомления читаются, когда сокет соединения готов к чтению:
+    ожидание не занимает поток и не выполняет запросов к postgres.
+    :param channel: канал NOTIFY
+    """
+
+    def __init__(self, dsn: PostgresDsn, channel: str, *args, **kwargs):
+        self.channel = channel
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._fileno: int | None = None
+        self._notifications: asyncio.Queue | None = None
+        super().__init__(dsn, *args, **kwargs)
+
+    def connect(self) -> None:
+        super().connect()
+        self._connection.autocommit = True
+        with self._connection.cursor() as cursor:
+            cursor.execute(SQL("LISTEN {}").format(Identifier(self.channel)))
+        logger.info(f"Подписка на канал postgres {self.channel}")
+
+    def start(self) -> None:
+        """Начать чтение уведомлений в текущем event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._notifications = asyncio.Queue()
+        self._fileno = self._connection.fileno()
+        self._loop.add_reader(self._fileno, self._read)
+
+    async def get(self, timeout: float | None = None) -> str | None:
+        """Полезная нагрузка следующего уведомления, None - по таймауту"""
+        try:
+            item = await asyncio.wait_for(self._notifications.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def close(self) -> None:
+        self._stop_reading()
+        super().close()
+
+    def _read(self) -> None:
+        try:
+            self._connection.poll()
+        except self.base_exceptions as error:
+            # Уведомления могли потеряться - решение за вызывающим кодом
+            self._stop_reading()
+            self._notifications.put_nowait(error)
+            return
+        while self._connection.notifies:
+            self._notifications.put_nowait(
+                self._connection.notifies.pop(0).payload
+            )
+
+    def _stop_reading(self) -> None:
+        if self._fileno is not None:
+            self._loop.remove_reader(self._fileno)
+            self._fileno = None
+
+
 class PostgresCursor(AbstractClientInterface):
     base_exceptions = psycopg2.OperationalError
     _cursor: pg_cursor
 
-    def __init__(self, connection: PostgresClient, *args, **kwargs):
+    def __init__(
+        self,
+        connection: PostgresClient,
+        name: str | None = None,
+        itersize: int | None = None,
+    ):
         self._connection = connection
-        self.connect(*args, **kwargs)
+        self.name = name
+        self.itersize = itersize
+        self._cursor = None
+        self.connect()
 
     @property
     def is_cursor_opened(self) -> bool:
@@ -71,12 +185,17 @@ class PostgresCursor(AbstractClientInterface):
         return self.is_connection_opened and self.is_cursor_opened
 
     @backoff(exceptions=(base_exceptions,))
-    def connect(self, *args, **kwargs) -> None:
+    def connect(self) -> None:
         # noinspection PyProtectedMember
         self._cursor: pg_cursor = self._connection._connection.cursor(
-            *args, **kwargs
+            name=self.name
+        )
+        if self.itersize:
+            self._cursor.itersize = self.itersize
+        logger.debug(
+            f"Создан новый {'серверный ' if self.name else ''}"
+            f"курсор для Postgres"
         )
-        logger.debug("Создан новый курсор для Postgres")
 
     def reconnect(self) -> None:
         if not self.is_connection_opened:
@@ -92,8 +211,120 @@ class PostgresCursor(AbstractClientInterface):
             self._cursor.close()
             logger.debug("Postgres cursor закрыт")
 
+    @backoff(exceptions=(base_exceptions,))
+    @client_reconnect
     def execute(self, query: str | SQL, *args, **kwargs) -> None:
         self._cursor.execute(query, *args, **kwargs)
 
     def fetchmany(self, chunk: int) -> list[Any]:
+        """Серверный курсор передаёт по сети только chunk строк"""
         return self._cursor.fetchmany(size=chunk)
+
+    def __iter__(self) -> Iterator[Any]:
+        """Построчная итерация, для серверного курсора - по itersize"""
+        return iter(self._cursor)
+
+
+class AsyncPostgresCursor:
+    """Курсор, блокирующие вызовы которого выполняются в пуле потоков"""
+
+    def __init__(self, cursor: PostgresCursor, run: Callable):
+        self._cursor = cursor
+        self._run = run
+
+    async def execute(self, query: str | SQL, *args, **kwargs) -> None:
+        await self._run(self._cursor.execute, query, *args, **kwargs)
+
+    async def fetchmany(self, chunk: int) -> list[Any]:
+        return await self._run(self._cursor.fetchmany, chunk)
+
+
+class AsyncPostgresClient:
+    """Соединение из PostgresPool, не блокирующее event loop"""
+
+    def __init__(self, client: PostgresClient, executor: ThreadPoolExecutor):
+        self.client = client
+        self._executor = executor
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, partial(func, *args, **kwargs)
+        )
+
+    @contextlib.asynccontextmanager
+    async def cursor(
+        self, name: str | None = None, itersize: int | None = None
+    ) -> AsyncIterator[AsyncPostgresCursor]:
+        context = self.client.cursor(name=name, itersize=itersize)
+        cursor: PostgresCursor = await self.run(context.__enter__)
+        try:
+            yield AsyncPostgresCursor(cursor, self.run)
+        finally:
+            await self.run(context.__exit__, None, None, None)
+
+    @contextlib.asynccontextmanager
+    async def snapshot(self) -> AsyncIterator[None]:
+        """Курсоры внутри блока читают один снимок данных"""
+        context = self.client.snapshot()
+        await self.run(context.__enter__)
+        try:
+            yield
+        finally:
+            await self.run(context.__exit__, None, None, None)
+
+
+class PostgresPool:
+    """
+    Пул соединений postgres для асинхронного ETL.
+    Каждый потребитель получает собственное соединение, а вызовы
+    psycopg2 выполняются в отдельных потоках, поэтому запросы
+    разных индексов идут параллельно и не блокируют event loop.
+    :param dsn: строка подключения
+    :param size: максимальное количество соединений
+    """
+
+    def __init__(self, dsn: PostgresDsn, size: int, *args, **kwargs):
+        self.dsn = dsn
+        self.size = size
+        self.args = args
+        self.kwargs = kwargs
+        self._clients: list[PostgresClient] = []
+        self._free: asyncio.Queue | None = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix="postgres"
+        )
+
+    @contextlib.asynccontextmanager
+    async def connection(self) -> AsyncIterator[AsyncPostgresClient]:
+        client = await self._acquire()
+        try:
+            yield AsyncPostgresClient(client, self._executor)
+        finally:
+            self._free.put_nowait(client)
+
+    async def _acquire(self) -> PostgresClient:
+        if self._free is None:
+            self._free = asyncio.Queue()
+        if self._free.empty() and len(self._clients) < self.size:
+            # Место в пуле резервируется до подключения,
+            # иначе параллельные вызовы превысят size
+            self._clients.append(None)
+            try:
+                client = await asyncio.get_running_loop().run_in_executor(
+                    self._executor,
+                    partial(PostgresClient, self.dsn, *self.args, **self.kwargs),
+                )
+            except BaseException:
+                self._clients.remove(None)
+                raise
+            self._clients[self._clients.index(None)] = client
+            return client
+        return await self._free.get()
+
+    def close(self) -> None:
+        for client in self._clients:
+            if client is not None:
+                client.close()
+        self._clients.clear()
+        self._free = None
+        self._executor.shutdown(wait=False)
@@ -1,3 +1,6 @@
+import asyncio
+import random
+import threading
 import time
 from functools import wraps
 from typing import Any
@@ -11,6 +14,8 @@ EXECUTION_ERROR = "Произошла ошибка при выполнении 
 MAX_ATTEMPTS = (
     "Превышено максимальное количество попыток восстановить соединение."
 )
+CIRCUIT_OPEN = "Соединение {name} разомкнуто после {failures} ошибок подряд."
+CIRCUIT_CLOSED = "Соединение {name} восстановлено."
 
 
 def reconnect(func: Callable) -> Any:
@@ -72,3 +77,164 @@ def backoff(
         return inner
 
     return func_wrapper
+
+
+def async_backoff(
+        exceptions: tuple,
+        start_sleep_time: float = 0.1,
+        factor: int = 2,
+        border_sleep_time: int = 10,
+        max_attempts: int = 10,
+) -> Callable:
+    """
+    Асинхронный вариант backoff: ожидание через asyncio.sleep не блокирует
+    event loop. Время ожидания растёт экспоненциально до border_sleep_time,
+    фактическая пауза выбирается случайно от 0 до него (full jitter),
+    чтобы клиенты не повторяли запросы синхронно.
+    После max_attempts попыток пробрасывается последняя ошибка.
+    :param exceptions: исключения, которые могут произойти
+    :param start_sleep_time: начальное время повтора
+    :param factor: во сколько раз нужно увеличить время ожидания
+    :param border_sleep_time: граничное время ожидания
+    :param max_attempts: максимальное количество попыток
+    """
+
+    def func_wrapper(func: Callable) -> Callable:
+        @wraps(func)
+        async def inner(*args, **kwargs) -> Any:
+            for attempt in range(max_attempts):
+                try:
+                    return await func(*args, **kwargs)
+                except exceptions as error:
+                    logger.error(
+                        EXECUTION_ERROR.format(name=func.__name__, error=error)
+                    )
+                    if attempt == max_attempts - 1:
+                        logger.error(MAX_ATTEMPTS)
+                        raise
+                    sleep_time = min(
+                        border_sleep_time, start_sleep_time * factor ** attempt
+                    )
+                    await asyncio.sleep(random.uniform(0, sleep_time))
+
+        return inner
+
+    return func_wrapper
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи, общий для всех вызовов одного клиента.
+    После failure_threshold ошибок подряд вызовы сразу завершаются
+    CircuitOpenError, через recovery_timeout секунд пропускается один
+    пробный вызов: успех замыкает цепь, ошибка снова размыкает.
+    Заменяет проверку ping перед каждым запросом: в штатном режиме
+    лишних запросов нет. Синхронный клиент вызывается из пула
+    потоков, поэтому состояние защищено блокировкой.
+    :param name: имя клиента для логов
+    :param failure_threshold: число ошибок подряд до размыкания
+    :param recovery_timeout: время до пробного вызова в секундах
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self._opened_at: float | None = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_call(self) -> None:
+        with self._lock:
+            if not self.is_open:
+                return
+            if (
+                self._trial_running
+                or time.monotonic() - self._opened_at < self.recovery_timeout
+            ):
+                raise CircuitOpenError(
+                    CIRCUIT_OPEN.format(name=self.name, failures=self.failures)
+                )
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.is_open:
+                logger.info(CIRCUIT_CLOSED.format(name=self.name))
+            self.failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def cancel_trial(self) -> None:
+        """Пробный вызов завершился без признака доступности клиента"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.is_open or self.failures >= self.failure_threshold:
+                if not self.is_open:
+                    logger.error(
+                        CIRCUIT_OPEN.format(
+                            name=self.name, failures=self.failures
+                        )
+                    )
+                self._opened_at = time.monotonic()
+
+
+def circuit(func: Callable) -> Callable:
+    """Вызов метода клиента через его client.breaker"""
+    if not asyncio.iscoroutinefunction(func):
+        return sync_circuit(func)
+
+    @wraps(func)
+    async def wrapper(client, *args, **kwargs):
+        client.breaker.before_call()
+        try:
+            result = await func(client, *args, **kwargs)
+        except client.base_exceptions:
+            client.breaker.record_failure()
+            raise
+        except BaseException:
+            client.breaker.cancel_trial()
+            raise
+        client.breaker.record_success()
+        return result
+
+    return wrapper
+
+
+def sync_circuit(func: Callable) -> Callable:
+    """Синхронный вариант circuit"""
+
+    @wraps(func)
+    def wrapper(client, *args, **kwargs):
+        client.breaker.before_call()
+        try:
+            result = func(client, *args, **kwargs)
+        except client.base_exceptions:
+            client.breaker.record_failure()
+            raise
+        except BaseException:
+            client.breaker.cancel_trial()
+            raise
+        client.breaker.record_success()
+        return result
+
+    return wrapper
@@ -0,0 +1,58 @@
+class AdaptiveBatchSize:
+    """
+    Подбор размера пачки по результатам bulk-запросов.
+    Из каждого ответа оценивается размер пачки, при котором запрос
+    уложился бы в target_latency секунд и target_bytes байт,
+    текущий размер сдвигается к меньшей из оценок со сглаживанием.
+    При ошибке запроса размер уменьшается вдвое.
+    :param initial: начальный размер пачки
+    :param min_size: нижняя граница размера
+    :param max_size: верхняя граница размера
+    :param target_latency: целевая длительность bulk-запроса
+    :param target_bytes: целевой размер тела bulk-запроса
+    :param smoothing: доля новой оценки в размере, 0..1
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_size: int,
+        max_size: int,
+        target_latency: float,
+        target_bytes: int,
+        smoothing: float = 0.3,
+    ):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.target_bytes = target_bytes
+        self.smoothing = smoothing
+        self._size = float(self._clamp(initial))
+
+    @property
+    def size(self) -> int:
+        return int(self._size)
+
+    def observe(self, documents: int, latency: float, body_bytes: int) -> int:
+        """Учесть успешный bulk-запрос, вернуть новый размер пачки"""
+        if documents <= 0:
+            return self.size
+        estimates = []
+        if latency > 0:
+            # Длительность bulk почти линейна по числу документов
+            estimates.append(documents * self.target_latency / latency)
+        if body_bytes > 0:
+            estimates.append(self.target_bytes / (body_bytes / documents))
+        if estimates:
+            self._size = self._clamp(
+                self._size + self.smoothing * (min(estimates) - self._size)
+            )
+        return self.size
+
+    def backoff(self) -> int:
+        """Запрос не прошёл - перегрузка или слишком большое тело"""
+        self._size = self._clamp(self._size / 2)
+        return self.size
+
+    def _clamp(self, size: float) -> float:
+        return min(max(size, self.min_size), self.max_size)
@@ -6,7 +6,12 @@ from pydantic import BaseSettings, Field
 from components import indexes, queries
 from components.logger import logger
 from components.models import FilmWork, Genre, ModelETL, PersonFilms
-from components.storage import JsonFileStorage, State
+from components.storage import (
+    BaseStorage,
+    JournalFileStorage,
+    JsonFileStorage,
+    State,
+)
 
 
 class PostgresConfig(BaseSettings):
@@ -16,6 +21,11 @@ class PostgresConfig(BaseSettings):
     host: str = Field(..., env="POSTGRES_HOST")
     port: int = Field(..., env="POSTGRES_PORT")
     options: str = Field(..., env="POSTGRES_OPTIONS")
+    server_side_cursors: bool = Field(True, env="POSTGRES_SERVER_SIDE_CURSORS")
+    itersize: int = Field(2000, env="POSTGRES_ITERSIZE")
+    pool_size: int | None = Field(None, env="POSTGRES_POOL_SIZE")
+    # TCP keepalive простаивающих соединений пула между циклами
+    keepalives_idle: int = Field(60, env="POSTGRES_KEEPALIVES_IDLE")
 
     @property
     def pg_dsn(self):
@@ -33,6 +43,20 @@ class PostgresConfig(BaseSettings):
 class ElasticConfig(BaseSettings):
     host: str = Field("localhost", env="ELASTIC_HOST")
     port: int = Field(9200, env="ELASTIC_PORT")
+    replicas: int = Field(1, env="ELASTIC_REPLICAS")
+    breaker_failures: int = Field(5, env="ELASTIC_BREAKER_FAILURES")
+    breaker_timeout: float = Field(30, env="ELASTIC_BREAKER_TIMEOUT")
+    # Размер пула соединений, None - по числу bulk_workers моделей
+    maxsize: int | None = Field(None, env="ELASTIC_MAXSIZE")
+    # Сколько секунд простаивающее соединение остаётся открытым,
+    # больше TIME_INTERVAL - соединения переживают паузу между циклами
+    keepalive_timeout: float = Field(300, env="ELASTIC_KEEPALIVE_TIMEOUT")
+    # Верхняя граница тела одного _bulk до сжатия
+    bulk_max_bytes: int = Field(
+        15 * 1024 * 1024, env="ELASTIC_BULK_MAX_BYTES"
+    )
+    # Уровень gzip для тел _bulk (1-9), 0 - без сжатия
+    compression_level: int = Field(0, env="ELASTIC_COMPRESSION_LEVEL")
 
     @property
     def elastic_dsn(self):
@@ -43,7 +67,73 @@ class ElasticConfig(BaseSettings):
         env_file_encoding = "utf-8"
 
 
+class StateConfig(BaseSettings):
+    backend: str = Field("journal", env="STATE_BACKEND")
+    fsync_interval: float = Field(1.0, env="STATE_FSYNC_INTERVAL")
+    compact_threshold: int = Field(1024 * 1024, env="STATE_COMPACT_THRESHOLD")
+
+    def get_storage(self, file_path: Path) -> BaseStorage:
+        """json - перезапись файла целиком, journal - журнал изменений"""
+        if self.backend == "json":
+            return JsonFileStorage(file_path=file_path)
+        return JournalFileStorage(
+            file_path=file_path,
+            fsync_interval=self.fsync_interval,
+            compact_threshold=self.compact_threshold,
+        )
+
+    class Config:
+        env_file = ".env"
+        env_file_encoding = "utf-8"
+
+
 class ETLConfig(BaseSettings):
+    pagination: str = Field("keyset", env="ETL_PAGINATION")
+    passthrough: bool = Field(False, env="ETL_PASSTHROUGH")
+    validation_sample: int = Field(100, env="ETL_VALIDATION_SAMPLE")
+    errors_max_size: int = Field(1000, env="ETL_ERRORS_MAX_SIZE")
+    errors_retention: int = Field(7 * 24 * 60 * 60, env="ETL_ERRORS_RETENTION")
+    # Размер сегмента dead-letter файлов индекса в байтах
+    dead_letter_segment_size: int = Field(
+        16 * 1024 * 1024, env="ETL_DEAD_LETTER_SEGMENT_SIZE"
+    )
+    # Процессы для валидации моделей, 0 - в потоке event loop
+    transform_workers: int = Field(0, env="ETL_TRANSFORM_WORKERS")
+    # Соединения, клиенты и проверенные индексы сохраняются между
+    # циклами и пересоздаются только после ошибки
+    daemon: bool = Field(False, env="ETL_DAEMON")
+    # Каждая модель ETL в своём процессе со своим файлом состояния
+    # state_{index}.json; упавший процесс перезапускается через
+    # restart_delay секунд. Процесс i отдаёт метрики на metrics_port + i
+    supervisor: bool = Field(False, env="ETL_SUPERVISOR")
+    restart_delay: float = Field(5.0, env="ETL_RESTART_DELAY")
+    # Размер пачки подбирается по длительности и размеру bulk-запросов
+    adaptive_batching: bool = Field(False, env="ETL_ADAPTIVE_BATCHING")
+    # Переименования персон и жанров применяются к фильмам частичным
+    # обновлением вместо пересборки документов
+    fanout: bool = Field(False, env="ETL_FANOUT")
+    # Процессы первичной загрузки индекса по диапазонам id, 0 и 1 -
+    # обычная выгрузка одним процессом
+    shards: int = Field(0, env="ETL_SHARDS")
+    # Документы с неизменившимся хэшем содержимого не отправляются
+    # повторно; в памяти держится fingerprints_memory_size отпечатков
+    fingerprints: bool = Field(False, env="ETL_FINGERPRINTS")
+    fingerprints_memory_size: int = Field(
+        100_000, env="ETL_FINGERPRINTS_MEMORY_SIZE"
+    )
+    # Порт HTTP endpoint метрик Prometheus, None - не запускать
+    metrics_port: int | None = Field(None, env="ETL_METRICS_PORT")
+    # poll - опрос раз в TIME_INTERVAL, listen - по уведомлениям
+    # триггеров postgres с опросом раз в fallback_interval
+    mode: str = Field("poll", env="ETL_MODE")
+    notify_channel: str = Field("etl_changes", env="ETL_NOTIFY_CHANNEL")
+    install_triggers: bool = Field(True, env="ETL_INSTALL_TRIGGERS")
+    # Пачка уведомлений закрывается после debounce секунд тишины,
+    # но не позже debounce_max_wait секунд после первого уведомления
+    debounce: float = Field(1.0, env="ETL_DEBOUNCE")
+    debounce_max_wait: float = Field(5.0, env="ETL_DEBOUNCE_MAX_WAIT")
+    fallback_interval: int = Field(600, env="ETL_FALLBACK_INTERVAL")
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -54,14 +144,37 @@ ETLFilmModel = ModelETL(
     index_name="movies",
     index_schema=indexes.FILMWORK_INDEX,
     query=queries.last_modified_films_query,
+    changes_queries=queries.changed_films_queries,
+    fanout_changes_queries=queries.changed_films_queries[:1],
+    fanout_queries=queries.changed_films_fanout_queries,
+    fanout_script=indexes.FILMWORK_FANOUT_SCRIPT,
+    enrich_query=queries.films_by_id_query,
+    shard_query=queries.films_shard_query,
+    passthrough_queries={
+        "query": queries.last_modified_films_documents_query,
+        "enrich_query": queries.films_documents_by_id_query,
+    },
+    notify_queries=queries.films_notify_queries,
     amount_query_args=3,
     model=FilmWork,
     batch_size=50,
+    max_batch_size=1000,
+    bulk_workers=4,
+    queue_size=8,
 )
 ETLGenreModel = ModelETL(
     index_name="genres",
     index_schema=indexes.GENRE_INDEX,
     query=queries.last_modified_genres_query,
+    keyset_query=queries.keyset_genres_query,
+    enrich_query=queries.genres_by_id_query,
+    shard_query=queries.genres_shard_query,
+    passthrough_queries={
+        "query": queries.last_modified_genres_documents_query,
+        "keyset_query": queries.keyset_genres_documents_query,
+        "enrich_query": queries.genres_documents_by_id_query,
+    },
+    notify_queries=queries.genres_notify_queries,
     amount_query_args=1,
     model=Genre,
     batch_size=100,
@@ -70,23 +183,42 @@ ETLPersonsFilmsModel = ModelETL(
     index_name="persons",
     index_schema=indexes.PERSONS_INDEX,
     query=queries.last_modified_persons_films_query,
+    keyset_query=queries.keyset_persons_films_query,
+    enrich_query=queries.persons_films_by_id_query,
+    shard_query=queries.persons_shard_query,
+    passthrough_queries={
+        "query": queries.last_modified_persons_documents_query,
+        "keyset_query": queries.keyset_persons_documents_query,
+        "enrich_query": queries.persons_documents_by_id_query,
+    },
+    notify_queries=queries.persons_notify_queries,
     amount_query_args=1,
     model=PersonFilms,
     batch_size=100,
 )
 
 storage_file_path = Path(Path(__file__).parents[1], "state", "state.json")
+fingerprints_file_path = storage_file_path.with_name("fingerprints.sqlite3")
+dead_letters_path = storage_file_path.with_name("deadletters")
+state_settings = StateConfig()
+
+
+def create_storage() -> State:
+    """Файл состояния открывается при создании настроек, не при импорте"""
+    return State(state_settings.get_storage(storage_file_path))
 
 
 class AppSettings(BaseSettings):
     es_settings: ElasticConfig = ElasticConfig()
+    etl_settings: ETLConfig = ETLConfig()
     etl_models: list[ModelETL] = [
         ETLPersonsFilmsModel,
         ETLGenreModel,
         ETLFilmModel,
     ]
     pg_settings: PostgresConfig = PostgresConfig()
-    storage: State = State(JsonFileStorage(file_path=storage_file_path))
+    state_settings: StateConfig = state_settings
+    storage: State = Field(default_factory=create_storage)
     sleep_interval: int = Field(120, env="TIME_INTERVAL")
     logger: logging.Logger = logger
 
@@ -0,0 +1,291 @@
+"""
+Dead-letter файлы индекса: документы, не прошедшие валидацию или
+отклонённые Elasticsearch, вместе с ошибкой и исходными данными.
+Записи только дописываются в сегменты `{index}/{номер}.jsonl`,
+успешная повторная обработка документа отмечается записью resolved.
+Сжатие оставляет в новом сегменте только нерешённые записи, оно
+выполняется, когда с прошлого сжатия дописано segment_size байт.
+"""
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Iterable, Iterator, NamedTuple, Union
+from uuid import UUID
+
+import orjson
+
+from components.logger import logger
+from components.storage import fsync_directory
+
+BROKEN_RECORD = "Dead-letter сегмент {name}: пропущена повреждённая строка {line}."
+SEGMENT_SUFFIX = ".jsonl"
+
+
+class DeadLetter(NamedTuple):
+    id: str
+    stage: str
+    error: str
+    timestamp: float
+
+
+class DeadLetterStore:
+    """
+    Нерешённые записи держатся в памяти без исходных данных,
+    по 16-байтному uuid: id нужны для отметки успешной обработки.
+    При превышении max_errors и по истечении retention старейшие
+    записи вытесняются, в файлах их убирает ближайшее сжатие.
+    :param directory: каталог dead-letter файлов всех индексов
+    :param index_name: имя индекса
+    :param segment_size: сколько байт дописывается между сжатиями
+    :param max_errors: сколько нерешённых записей хранится
+    :param retention: время хранения записи в секундах
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        index_name: str,
+        segment_size: int = 16 * 1024 * 1024,
+        max_errors: int = 1000,
+        retention: int = 7 * 24 * 60 * 60,
+    ):
+        self.index_name = index_name
+        self.segment_size = segment_size
+        self.max_errors = max_errors
+        self.retention = retention
+        self._directory = Path(directory, index_name)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        # uuid.bytes -> (stage, error, timestamp), от старых к новым
+        self._pending: OrderedDict[bytes, tuple[str, str, float]] = (
+            OrderedDict()
+        )
+        self._broken = False
+        now = time.time()
+        for record in self._read():
+            # Вытеснение при чтении повторяет вытеснение при записи
+            self._apply(record)
+            self._evict(now)
+        self._segment = self._last_segment()
+        # Байт дописано с прошлого сжатия
+        self._appended = (
+            self._segment.stat().st_size if self._segment.exists() else 0
+        )
+        if (
+            self._broken
+            or len(self._segments()) > 1
+            or self._appended >= self.segment_size
+        ):
+            # Дописывать после оборванной строки нельзя
+            self.compact()
+
+    def add(
+        self,
+        stage: str,
+        errors: dict[Any, str],
+        payloads: dict[Any, Any] | None = None,
+    ) -> None:
+        """Записать ошибки этапа с исходными данными документов"""
+        if not errors:
+            return
+        payloads = payloads or {}
+        now = time.time()
+        records = []
+        for doc_id, error in errors.items():
+            record = {
+                "id": str(doc_id),
+                "stage": stage,
+                "error": str(error),
+                "timestamp": now,
+                "payload": payloads.get(doc_id),
+            }
+            self._apply(record)
+            records.append(record)
+        self._evict(now)
+        self._append(records)
+
+    def resolve(self, ids: Iterable, stage: str | None = None) -> None:
+        """
+        Отметить документы обработанными.
+        :param stage: снимаются только ошибки этого этапа, None - все
+        """
+        if not self._pending:
+            return
+        records = []
+        for doc_id in ids:
+            key = self._key(doc_id)
+            letter = self._pending.get(key)
+            if letter and (stage is None or letter[0] == stage):
+                record = {"id": str(UUID(bytes=key)), "resolved": True}
+                self._apply(record)
+                records.append(record)
+        self._append(records)
+
+    def pending(self, stage: str | None = None) -> Iterator[DeadLetter]:
+        """Нерешённые записи от старых к новым"""
+        for key, (letter_stage, error, timestamp) in self._pending.items():
+            if stage is None or letter_stage == stage:
+                yield DeadLetter(
+                    str(UUID(bytes=key)), letter_stage, error, timestamp
+                )
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __contains__(self, doc_id) -> bool:
+        return self._key(doc_id) in self._pending
+
+    def get(self, doc_id) -> DeadLetter | None:
+        key = self._key(doc_id)
+        if key not in self._pending:
+            return None
+        return DeadLetter(str(UUID(bytes=key)), *self._pending[key])
+
+    def compact(self) -> None:
+        """
+        Перенести в новый сегмент нерешённые записи в пределах
+        max_errors и retention, старые сегменты удалить.
+        """
+        self._evict(time.time())
+        old_segments = self._segments()
+        # Исходные данные читаются только для хранимых записей
+        latest: dict[bytes, dict] = {}
+        for record in self._read():
+            key = self._key(record["id"])
+            letter = self._pending.get(key)
+            if (
+                not record.get("resolved")
+                and letter
+                and letter[0] == record["stage"]
+                and letter[2] == record["timestamp"]
+            ):
+                latest[key] = record
+        kept = [latest[key] for key in self._pending if key in latest]
+        self._pending = OrderedDict()
+        for record in kept:
+            self._apply(record)
+        self._segment = self._segment_path(
+            self._number(old_segments[-1]) + 1 if old_segments else 0
+        )
+        self._write(kept)
+        # Новый сегмент на диске до удаления старых
+        fsync_directory(self._directory)
+        self._appended = 0
+        for segment in old_segments:
+            segment.unlink()
+        fsync_directory(self._directory)
+        self._broken = False
+
+    @staticmethod
+    def _key(doc_id) -> bytes:
+        if not isinstance(doc_id, UUID):
+            doc_id = UUID(str(doc_id))
+        return doc_id.bytes
+
+    def _apply(self, record: dict) -> None:
+        key = self._key(record["id"])
+        self._pending.pop(key, None)
+        if not record.get("resolved"):
+            self._pending[key] = (
+                record["stage"],
+                record["error"],
+                record["timestamp"],
+            )
+
+    def _evict(self, now: float) -> None:
+        """Вытеснить старейшие записи сверх max_errors и старше retention"""
+        while self._pending:
+            key, (_, _, timestamp) = next(iter(self._pending.items()))
+            if (
+                len(self._pending) <= self.max_errors
+                and now - timestamp <= self.retention
+            ):
+                break
+            del self._pending[key]
+
+    def _append(self, records: list[dict]) -> None:
+        self._appended += self._write(records)
+        if self._appended >= self.segment_size:
+            self.compact()
+
+    def _write(self, records: list[dict]) -> int:
+        """
+        Дописать записи с fsync: записи появляются только при ошибках
+        и повторной обработке, их потеря дороже лишнего fsync
+        """
+        if not records:
+            return 0
+        body = b"".join(
+            orjson.dumps(record, default=str) + b"\n" for record in records
+        )
+        created = not self._segment.exists()
+        with open(self._segment, "ab") as segment:
+            segment.write(body)
+            segment.flush()
+            os.fsync(segment.fileno())
+        if created:
+            fsync_directory(self._directory)
+        return len(body)
+
+    def _read(self) -> Iterator[dict]:
+        for segment in self._segments():
+            with open(segment, "rb") as read_file:
+                for line_number, line in enumerate(read_file, start=1):
+                    try:
+                        yield orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        # Оборванная при падении последняя строка
+                        self._broken = True
+                        logger.warning(
+                            BROKEN_RECORD.format(
+                                name=segment, line=line_number
+                            )
+                        )
+
+    def _segments(self) -> list[Path]:
+        return sorted(
+            self._directory.glob(f"*{SEGMENT_SUFFIX}"), key=self._number
+        )
+
+    def _last_segment(self) -> Path:
+        segments = self._segments()
+        return segments[-1] if segments else self._segment_path(0)
+
+    def _segment_path(self, number: int) -> Path:
+        return Path(self._directory, f"{number:08d}{SEGMENT_SUFFIX}")
+
+    @staticmethod
+    def _number(segment: Path) -> int:
+        return int(segment.stem)
+
+
+class DeadLetters:
+    """
+    Dead-letter файлы индексов процесса: каждый индекс читается
+    с диска один раз, дальше записи обслуживаются из памяти.
+    Параметры - как у DeadLetterStore.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        segment_size: int = 16 * 1024 * 1024,
+        max_errors: int = 1000,
+        retention: int = 7 * 24 * 60 * 60,
+    ):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_errors = max_errors
+        self.retention = retention
+        self._stores: dict[str, DeadLetterStore] = {}
+
+    def store(self, index_name: str) -> DeadLetterStore:
+        if index_name not in self._stores:
+            self._stores[index_name] = DeadLetterStore(
+                directory=self.directory,
+                index_name=index_name,
+                segment_size=self.segment_size,
+                max_errors=self.max_errors,
+                retention=self.retention,
+            )
+        return self._stores[index_name]
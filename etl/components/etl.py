@@ -1,50 +1,395 @@
 import asyncio
+import copy
+import functools
+import hashlib
+import json
+from concurrent.futures import Executor
 from datetime import datetime
 
+from psycopg2.sql import SQL, Identifier, Literal
+
 from clients.elasticsearch_clients import (
     ElasticsearchAsyncClient,
     ElasticsearchClient,
+    KeepAliveConnection,
 )
-from clients.postgres_client import PostgresClient
-from components.pipe import Pipe
+from clients.postgres_client import PostgresPool
+from components import queries
+from components.backoff import CircuitBreaker
 from components.config import AppSettings
+from components.deadletter import DeadLetters, DeadLetterStore
+from components.fingerprints import FingerprintCache
+from components.models import ModelETL
+from components.notify import ChangeSet
+from components.pipe import Pipe
+from components.sharding import ShardedPipe
+
+# Размер пула соединений aiohttp клиента Elasticsearch по умолчанию
+DEFAULT_CONNECTIONS = 10
+PIPE_ERROR = "Выгрузка индекса {index} прервана: {error}."
+REINDEX_STARTED = "Полная переиндексация {alias} в новый индекс {index}."
+REINDEX_FINISHED = "Псевдоним {alias} переключён на {index}, удалены: {old}."
+TRIGGERS_INSTALLED = "Триггеры уведомлений установлены для таблиц: {tables}."
+CHANGES_RECEIVED = "Изменения из уведомлений postgres: {changes}."
+DEAD_LETTERS_RETRIED = (
+    "Повторная выгрузка индекса {index}: {total} документов "
+    "из dead-letter файлов, осталось с ошибкой {left}."
+)
+
+
+def create_breaker(settings: AppSettings) -> CircuitBreaker:
+    """Размыкатель, общий для синхронного и асинхронного клиентов"""
+    es_settings = settings.es_settings
+    return CircuitBreaker(
+        name="Elasticsearch",
+        failure_threshold=es_settings.breaker_failures,
+        recovery_timeout=es_settings.breaker_timeout,
+    )
 
 
 class ETL:
     def __init__(
         self,
         elastic_conn: ElasticsearchClient,
-        pg_conn: PostgresClient,
+        pg_pool: PostgresPool,
         settings: AppSettings,
+        transform_pool: Executor | None = None,
+        fingerprints: FingerprintCache | None = None,
+        dead_letters: DeadLetters | None = None,
     ):
         self.elastic_conn = elastic_conn
-        self.pg_conn = pg_conn
+        self.pg_pool = pg_pool
         self.settings = settings
+        self.transform_pool = transform_pool
+        self.fingerprints = fingerprints
+        self.dead_letters = dead_letters
+        self._async_elastic_conn: ElasticsearchAsyncClient | None = None
+        # Индекс -> хэш схемы, с которой проверено его существование
+        self._verified_indices: dict[str, str] = {}
 
-    async def start_pipeline(self) -> None:
-        last_modified: datetime = (
-            self.settings.storage.get_state("modified") or datetime.min
+    @property
+    def async_elastic_conn(self) -> ElasticsearchAsyncClient:
+        """Клиент создаётся один раз и живёт до close"""
+        if self._async_elastic_conn is None:
+            self._async_elastic_conn = self.create_async_client()
+        return self._async_elastic_conn
+
+    def create_async_client(self) -> ElasticsearchAsyncClient:
+        es_settings = self.settings.es_settings
+        return ElasticsearchAsyncClient(
+            dsn=self.elastic_conn.dsn,
+            breaker=self.elastic_conn.breaker,
+            compression_level=es_settings.compression_level,
+            connection_class=KeepAliveConnection,
+            keepalive_timeout=es_settings.keepalive_timeout,
+            maxsize=es_settings.maxsize
+            or max(
+                DEFAULT_CONNECTIONS,
+                sum(
+                    model_params.bulk_workers
+                    for model_params in self.settings.etl_models
+                ),
+            ),
+        )
+
+    def get_dead_letters(
+        self, model_params: ModelETL
+    ) -> DeadLetterStore | None:
+        """Dead-letter файлы индекса, открытые в процессе один раз"""
+        if self.dead_letters is None:
+            return None
+        return self.dead_letters.store(model_params.index_name)
+
+    async def close(self) -> None:
+        if self._async_elastic_conn is not None:
+            await self._async_elastic_conn.close()
+            self._async_elastic_conn = None
+        self._verified_indices.clear()
+
+    async def in_thread(self, func, *args, **kwargs):
+        """
+        Вызов синхронного клиента Elasticsearch в пуле потоков:
+        ожидание ответа и паузы backoff не блокируют event loop
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(func, *args, **kwargs)
+        )
+
+    async def ensure_index(self, model_params: ModelETL) -> None:
+        """
+        Проверка индекса обращается к Elasticsearch, только если индекс
+        ещё не проверялся с этой схемой или его выгрузка падала.
+        """
+        fanout_script = (
+            model_params.fanout_script
+            if self.settings.etl_settings.fanout
+            else None
         )
-        async_elastic_conn: ElasticsearchAsyncClient = (
-            ElasticsearchAsyncClient(dsn=self.elastic_conn.dsn)
+        schema_hash = hashlib.sha1(
+            json.dumps(
+                [model_params.index_schema, fanout_script], sort_keys=True
+            ).encode()
+        ).hexdigest()
+        if self._verified_indices.get(model_params.index_name) == schema_hash:
+            return
+        created = await self.in_thread(
+            self.elastic_conn.create_index_if_not_exists,
+            index_name=model_params.index_name,
+            index_schema=model_params.index_schema,
         )
-        tasks = []
+        if created and self.fingerprints is not None:
+            # Отпечатки относятся к документам удалённого индекса
+            self.fingerprints.clear(model_params.index_name)
+        if fanout_script:
+            await self.in_thread(
+                self.elastic_conn.put_script,
+                model_params.fanout_script_id,
+                fanout_script,
+            )
+        self._verified_indices[model_params.index_name] = schema_hash
+
+    async def start_pipeline(self) -> None:
+        pipes = []
         for model_params in self.settings.etl_models:
-            self.elastic_conn.create_index_if_not_exists(
-                index_name=model_params.index_name,
-                index_schema=model_params.index_schema,
+            await self.ensure_index(model_params)
+            pipes.append(self.create_pipe(model_params))
+        results = await self.run_pipes(pipes)
+        self.log_failures(pipes, results)
+
+    def create_pipe(
+        self, model_params: ModelETL, target_index: str | None = None
+    ) -> Pipe:
+        """
+        Пустой индекс при ETL_SHARDS > 1 загружается процессами
+        по диапазонам id, дальше - обычной выгрузкой по метке.
+        """
+        params = dict(
+            elastic_conn=self.async_elastic_conn,
+            model_params=model_params,
+            pg_pool=self.pg_pool,
+            settings=self.settings,
+            target_index=target_index,
+            transform_pool=self.transform_pool,
+            fingerprints=self.fingerprints,
+            dead_letters=self.get_dead_letters(model_params),
+        )
+        pipe = Pipe(**params)
+        shards = self.settings.etl_settings.shards
+        if (
+            shards > 1
+            and model_params.shard_query
+            and pipe.get_watermark() == datetime.min
+        ):
+            return ShardedPipe(**params, shards=shards)
+        return pipe
+
+    async def sync_changes(self, changes: ChangeSet) -> None:
+        """Выгрузка документов, затронутых изменениями из уведомлений"""
+        self.settings.logger.info(
+            CHANGES_RECEIVED.format(
+                changes={key: len(ids) for key, ids in changes.items()}
             )
+        )
+        models = [
+            model_params
+            for model_params in self.settings.etl_models
+            if changes.keys() & model_params.notify_queries.keys()
+        ]
+        pipes = []
+        for model_params in models:
+            await self.ensure_index(model_params)
+            pipes.append(
+                Pipe(
+                    elastic_conn=self.async_elastic_conn,
+                    model_params=model_params,
+                    pg_pool=self.pg_pool,
+                    settings=self.settings,
+                    transform_pool=self.transform_pool,
+                    fingerprints=self.fingerprints,
+                    changes=changes,
+                    dead_letters=self.get_dead_letters(model_params),
+                )
+            )
+        results = await self.run_pipes(pipes)
+        self.log_failures(pipes, results)
+
+    async def retry_dead_letters(
+        self, index_names: list[str] | None = None
+    ) -> None:
+        """
+        Повторная выгрузка только документов из dead-letter файлов
+        пачками по batch_size, без полной переиндексации.
+        :param index_names: индексы, None - все
+        """
+        pipes = []
+        for model_params in self.settings.etl_models:
+            if index_names and model_params.index_name not in index_names:
+                continue
             pipe = Pipe(
-                elastic_conn=async_elastic_conn,
-                last_modified=last_modified,
+                elastic_conn=self.async_elastic_conn,
                 model_params=model_params,
-                pg_conn=self.pg_conn,
+                pg_pool=self.pg_pool,
                 settings=self.settings,
+                transform_pool=self.transform_pool,
+                fingerprints=self.fingerprints,
+                retry_dead_letters=True,
+                dead_letters=self.get_dead_letters(model_params),
             )
-            tasks.extend([pipe.load(), pipe.extract()])
-        await asyncio.gather(
-            *tasks,
-            return_exceptions=False,
+            if pipe.retry_ids:
+                await self.ensure_index(model_params)
+                pipes.append(pipe)
+        results = await self.run_pipes(pipes)
+        self.log_failures(pipes, results)
+        for pipe in pipes:
+            dead_letters = pipe.tracker.dead_letters
+            dead_letters.compact()
+            self.settings.logger.info(
+                DEAD_LETTERS_RETRIED.format(
+                    index=pipe.model_params.index_name,
+                    total=len(pipe.retry_ids),
+                    left=len(dead_letters),
+                )
+            )
+
+    async def install_notify_triggers(self) -> None:
+        """Функция и триггеры content.* для LISTEN/NOTIFY, идемпотентно"""
+        channel = self.settings.etl_settings.notify_channel
+        async with self.pg_pool.connection() as pg_conn:
+            async with pg_conn.cursor() as cur:
+                await cur.execute(queries.notify_function_query)
+                for table, columns in queries.notify_tables.items():
+                    await cur.execute(
+                        SQL(queries.notify_trigger_query).format(
+                            table=Identifier(table),
+                            arguments=SQL(", ").join(
+                                map(Literal, (channel, *columns))
+                            ),
+                        )
+                    )
+        self.settings.logger.info(
+            TRIGGERS_INSTALLED.format(tables=list(queries.notify_tables))
+        )
+
+    async def full_reindex(self, index_names: list[str] | None = None) -> None:
+        """
+        Полная переиндексация без простоя: документы пишутся в новый
+        индекс `{index}_v{N}` без реплик и с отключённым refresh,
+        затем настройки восстанавливаются, индекс сливается
+        в один сегмент и псевдоним `{index}` атомарно переключается.
+        Читатели до переключения видят старый индекс целиком.
+        :param index_names: индексы для переиндексации, None - все
+        """
+        models = [
+            model_params
+            for model_params in self.settings.etl_models
+            if not index_names or model_params.index_name in index_names
+        ]
+        pipes = [
+            self.create_pipe(
+                model_params,
+                target_index=await self.create_index_version(model_params),
+            )
+            for model_params in models
+        ]
+        results = await self.run_pipes(pipes)
+        self.log_failures(pipes, results)
+        for pipe, result in zip(pipes, results):
+            if isinstance(result, BaseException):
+                await self.in_thread(
+                    self.elastic_conn.delete_index, pipe.target_index
+                )
+                self.settings.storage.delete_state(pipe.watermark_key)
+                if isinstance(pipe, ShardedPipe):
+                    self.settings.storage.delete_state(pipe.shards_key)
+                if self.fingerprints is not None:
+                    self.fingerprints.clear(pipe.target_index)
+            else:
+                await self.publish_index_version(pipe)
+
+    async def create_index_version(self, model_params: ModelETL) -> str:
+        alias = model_params.index_name
+        indices = await self.in_thread(
+            self.elastic_conn.get_indices, f"{alias}_v*"
+        )
+        versions = [
+            int(index.rsplit("_v", 1)[1])
+            for index in indices
+            if index.rsplit("_v", 1)[1].isdigit()
+        ]
+        index = f"{alias}_v{max(versions, default=0) + 1}"
+        body = copy.deepcopy(model_params.index_schema)
+        body.setdefault("settings", {}).update(
+            {"refresh_interval": "-1", "number_of_replicas": 0}
+        )
+        await self.in_thread(
+            self.elastic_conn.index_create, index=index, body=body
         )
-        self.settings.storage.set_state("modified", datetime.now().isoformat())
-        await async_elastic_conn.close()
+        self.settings.logger.info(
+            REINDEX_STARTED.format(alias=alias, index=index)
+        )
+        return index
+
+    async def publish_index_version(self, pipe: Pipe) -> None:
+        alias = pipe.model_params.index_name
+        index = pipe.target_index
+        schema_settings = pipe.model_params.index_schema.get("settings", {})
+        await self.in_thread(self.elastic_conn.refresh, index)
+        # Слияние до включения реплик: реплики копируют готовые сегменты
+        await self.in_thread(self.elastic_conn.forcemerge, index)
+        await self.in_thread(
+            self.elastic_conn.update_settings,
+            index,
+            {
+                "index": {
+                    "refresh_interval": schema_settings.get(
+                        "refresh_interval", "1s"
+                    ),
+                    "number_of_replicas": self.settings.es_settings.replicas,
+                }
+            },
+        )
+        old_indices = await self.in_thread(
+            self.elastic_conn.get_alias_indices, alias
+        )
+        if not old_indices and await self.in_thread(
+            self.elastic_conn.index_exists, alias
+        ):
+            old_indices = [alias]
+        await self.in_thread(
+            self.elastic_conn.swap_alias, alias, index, old_indices
+        )
+        for old_index in old_indices:
+            if old_index != alias:
+                await self.in_thread(self.elastic_conn.delete_index, old_index)
+        watermark = self.settings.storage.get_state(pipe.watermark_key)
+        if watermark:
+            self.settings.storage.set_state(
+                f"{alias}_modified", watermark, sync=True
+            )
+        self.settings.storage.delete_state(pipe.watermark_key)
+        if self.fingerprints is not None:
+            self.fingerprints.rename(index, alias)
+        self.settings.logger.info(
+            REINDEX_FINISHED.format(alias=alias, index=index, old=old_indices)
+        )
+
+    @staticmethod
+    async def run_pipes(pipes: list[Pipe]) -> list:
+        # Индексы независимы: ошибка одного не отменяет выгрузку остальных,
+        # а его метка остаётся на последней подтверждённой пачке
+        return await asyncio.gather(
+            *(pipe.run() for pipe in pipes),
+            return_exceptions=True,
+        )
+
+    def log_failures(self, pipes: list[Pipe], results: list) -> None:
+        for pipe, result in zip(pipes, results):
+            if isinstance(result, BaseException):
+                # После ошибки индекс проверяется заново
+                self._verified_indices.pop(pipe.model_params.index_name, None)
+                self.settings.logger.error(
+                    PIPE_ERROR.format(
+                        index=pipe.target_index, error=result
+                    ),
+                    exc_info=result,
+                )
@@ -0,0 +1,140 @@
+"""
+Отпечатки загруженных документов: id -> 128-битный хэш содержимого.
+Документ, отпечаток которого не изменился, не отправляется
+в Elasticsearch повторно. Отпечатки хранятся в sqlite рядом
+с состоянием ETL, последние использованные держатся в памяти.
+"""
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Union
+
+import orjson
+
+# Ограничение sqlite на число параметров запроса
+SQLITE_MAX_PARAMS = 500
+
+
+def fingerprint(source: dict | str) -> bytes:
+    """Хэш документа; json-текст режима passthrough хэшируется как есть"""
+    if isinstance(source, str):
+        body = source.encode("utf-8")
+    else:
+        body = orjson.dumps(source, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+class FingerprintCache:
+    """
+    Отпечатки документов по индексам Elasticsearch.
+    Запись - только после подтверждения документа в ответе _bulk,
+    иначе не загруженный документ считался бы неизменным.
+    :param file_path: файл базы sqlite
+    :param memory_size: сколько отпечатков держать в памяти
+    """
+
+    def __init__(self, file_path: Union[str, Path], memory_size: int):
+        self._memory_size = memory_size
+        self._memory: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+        self._connection = sqlite3.connect(file_path, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                index_name TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                digest BLOB NOT NULL,
+                PRIMARY KEY (index_name, doc_id)
+            ) WITHOUT ROWID
+            """
+        )
+        self._connection.commit()
+
+    def unchanged(
+        self, index: str, digests: dict[str, bytes]
+    ) -> set[str]:
+        """id документов, отпечатки которых совпадают с сохранёнными"""
+        stored = {}
+        missing = []
+        for doc_id in digests:
+            digest = self._memory.get((index, doc_id))
+            if digest is None:
+                missing.append(doc_id)
+            else:
+                self._memory.move_to_end((index, doc_id))
+                stored[doc_id] = digest
+        for start in range(0, len(missing), SQLITE_MAX_PARAMS):
+            chunk = missing[start:start + SQLITE_MAX_PARAMS]
+            rows = self._connection.execute(
+                "SELECT doc_id, digest FROM fingerprints "
+                f"WHERE index_name = ? AND doc_id IN "
+                f"({', '.join('?' * len(chunk))})",
+                (index, *chunk),
+            )
+            for doc_id, digest in rows:
+                stored[doc_id] = digest
+                self._remember(index, doc_id, digest)
+        return {
+            doc_id
+            for doc_id, digest in digests.items()
+            if stored.get(doc_id) == digest
+        }
+
+    def update(self, index: str, digests: dict[str, bytes]) -> None:
+        if not digests:
+            return
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?)",
+                ((index, doc_id, digest) for doc_id, digest in digests.items()),
+            )
+        for doc_id, digest in digests.items():
+            self._remember(index, doc_id, digest)
+
+    def discard(self, index: str, ids: Iterable[str]) -> None:
+        """Документ изменён в обход отпечатков - частичным обновлением"""
+        ids = list(ids)
+        with self._connection:
+            self._connection.executemany(
+                "DELETE FROM fingerprints WHERE index_name = ? AND doc_id = ?",
+                ((index, doc_id) for doc_id in ids),
+            )
+        for doc_id in ids:
+            self._memory.pop((index, doc_id), None)
+
+    def clear(self, index: str) -> None:
+        """Индекс создан заново или удалён"""
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM fingerprints WHERE index_name = ?", (index,)
+            )
+        self._drop_memory(index)
+
+    def rename(self, index: str, new_index: str) -> None:
+        """Отпечатки версии индекса переходят к его псевдониму"""
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM fingerprints WHERE index_name = ?", (new_index,)
+            )
+            self._connection.execute(
+                "UPDATE fingerprints SET index_name = ? WHERE index_name = ?",
+                (new_index, index),
+            )
+        self._drop_memory(index)
+        self._drop_memory(new_index)
+
+    def close(self) -> None:
+        self._memory.clear()
+        self._connection.close()
+
+    def _remember(self, index: str, doc_id: str, digest: bytes) -> None:
+        self._memory[(index, doc_id)] = digest
+        self._memory.move_to_end((index, doc_id))
+        while len(self._memory) > self._memory_size:
+            self._memory.popitem(last=False)
+
+    def _drop_memory(self, index: str) -> None:
+        for key in [key for key in self._memory if key[0] == index]:
+            del self._memory[key]
@@ -156,3 +156,57 @@ PERSONS_INDEX = {
         },
     },
 }
+
+# Частичное обновление фильма при переименовании персон и жанров:
+# params.persons / params.genres - {id: новое имя}. В массивах *_names
+# старое имя заменяется новым на том же месте: порядок остаётся тем,
+# который дала полная сборка в postgres. Имена вложенных объектов,
+# которых нет в массиве, дописываются в конец. Без изменений - noop
+FILMWORK_FANOUT_SCRIPT = """
+boolean changed = false;
+if (params.containsKey('persons')) {
+  for (String role : ['actors', 'directors', 'writers']) {
+    def items = ctx._source[role];
+    if (items == null) { continue; }
+    def renames = new HashMap();
+    for (def item : items) {
+      def name = params.persons[item.id];
+      if (name != null && name != item.full_name) {
+        renames[item.full_name] = name;
+        item.full_name = name;
+      }
+    }
+    if (!renames.isEmpty()) {
+      def current = new LinkedHashSet();
+      for (def item : items) { current.add(item.full_name); }
+      def seen = new HashSet();
+      def names = new ArrayList();
+      def previous = ctx._source[role + '_names'];
+      if (previous != null) {
+        for (def old : previous) {
+          def name = old;
+          if (!current.contains(old) && renames.containsKey(old)) {
+            name = renames[old];
+          }
+          if (current.contains(name) && seen.add(name)) { names.add(name); }
+        }
+      }
+      for (def name : current) {
+        if (seen.add(name)) { names.add(name); }
+      }
+      ctx._source[role + '_names'] = names;
+      changed = true;
+    }
+  }
+}
+if (params.containsKey('genres') && ctx._source.genres != null) {
+  for (def item : ctx._source.genres) {
+    def name = params.genres[item.id];
+    if (name != null && name != item.name) {
+      item.name = name;
+      changed = true;
+    }
+  }
+}
+if (!changed) { ctx.op = 'noop'; }
+"""
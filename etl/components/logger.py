@@ -1,23 +1,46 @@
+"""
+Логирование без ввода-вывода в вызывающем потоке: логгер etl
+кладёт записи в очередь, форматирование и запись в файл и stdout
+выполняет поток QueueListener. Сообщения с аргументами форматируются
+лениво - уже в потоке записи и только для включённых уровней.
+Файл логов пишет только основной процесс: процессы, созданные через
+fork, отправляют ему записи через межпроцессную очередь, иначе
+каждый из них ротировал бы etl.log в полночь сам.
+"""
+import atexit
 import logging
+import multiprocessing
+import os
+import queue
 import sys
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timezone
 from logging import Formatter
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    TimedRotatingFileHandler,
+)
 from pathlib import Path
+from typing import Iterable
+
+import orjson
+from pydantic import BaseSettings, Field
+
+
+class LoggingConfig(BaseSettings):
+    level: str = Field("DEBUG", env="LOG_LEVEL")
+    # text - строки LOGS_FORMAT, json - запись одним json-объектом
+    format: str = Field("text", env="LOG_FORMAT")
+    # Длина выводимого списка id и частота сводок ошибок пачек
+    ids_limit: int = Field(20, env="LOG_IDS_LIMIT")
+    summary_interval: float = Field(10.0, env="LOG_SUMMARY_INTERVAL")
+
+    class Config:
+        env_file = ".env"
+        env_file_encoding = "utf-8"
 
-logger = logging.getLogger("etl")
-logger.setLevel(logging.DEBUG)
-time_rotated_handler = TimedRotatingFileHandler(
-    backupCount=7,
-    encoding="utf-8",
-    filename=Path(
-        Path(__file__).parents[1],
-        "logs",
-        "etl.log".format(datetime.now()),
-    ),
-    interval=1,
-    when="midnight",
-)
 
 LOGS_FORMAT = (
     "| %(asctime)s – [%(levelname)s]: %(message)s. "
@@ -25,6 +48,166 @@ LOGS_FORMAT = (
     "функция – '%(funcName)s'(%(lineno)d)"
 )
 
-time_rotated_handler.setFormatter(Formatter(LOGS_FORMAT))
-logger.addHandler(time_rotated_handler)
-logger.addHandler(logging.StreamHandler(sys.stdout))
+# Атрибуты LogRecord; остальные пришли из extra и попадают в json
+RECORD_ATTRIBUTES = frozenset(
+    vars(logging.LogRecord("", 0, "", 0, "", None, None))
+) | {"message", "asctime"}
+
+
+class JsonFormatter(Formatter):
+    """Запись и поля из extra одним json-объектом в строке"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            "time": datetime.fromtimestamp(
+                record.created, timezone.utc
+            ).isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "process": record.process,
+            "file": record.filename,
+            "function": record.funcName,
+            "line": record.lineno,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                document[key] = value
+        if record.exc_info:
+            document["exception"] = self.formatException(record.exc_info)
+        return orjson.dumps(document, default=str).decode()
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Запись уходит в очередь без форматирования: очередь и поток
+    записи в том же процессе, сериализация для pickle не нужна.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class IdList:
+    """
+    Список id для сообщения: первые limit значений и общее число.
+    Строка собирается лениво, в потоке записи.
+    """
+
+    def __init__(self, ids: Iterable, limit: int | None = None):
+        self.ids = list(ids)
+        self.limit = config.ids_limit if limit is None else limit
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __str__(self) -> str:
+        shown = ", ".join(str(doc_id) for doc_id in self.ids[: self.limit])
+        hidden = len(self.ids) - self.limit
+        if hidden > 0:
+            return f"[{shown}, … ещё {hidden}] (всего {len(self.ids)})"
+        return f"[{shown}]"
+
+
+class SummaryLimiter:
+    """
+    Не чаще одного сообщения на ключ за interval секунд.
+    Пропущенные между сообщениями события суммируются.
+    """
+
+    def __init__(self, interval: float | None = None):
+        self.interval = (
+            config.summary_interval if interval is None else interval
+        )
+        self._lock = threading.Lock()
+        self._last: dict[str, float] = {}
+        self._suppressed: dict[str, int] = {}
+
+    def allow(self, key: str) -> int | None:
+        """
+        Число подавленных событий с прошлого сообщения,
+        None - сообщение сейчас писать не нужно
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, float("-inf")) < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return None
+            self._last[key] = now
+            return self._suppressed.pop(key, 0)
+
+
+def create_handlers() -> list[logging.Handler]:
+    time_rotated_handler = TimedRotatingFileHandler(
+        backupCount=7,
+        encoding="utf-8",
+        filename=Path(Path(__file__).parents[1], "logs", "etl.log"),
+        interval=1,
+        when="midnight",
+    )
+    stream_handler = logging.StreamHandler(sys.stdout)
+    formatter = (
+        JsonFormatter() if config.format == "json" else Formatter(LOGS_FORMAT)
+    )
+    for handler in (time_rotated_handler, stream_handler):
+        handler.setFormatter(formatter)
+    return [time_rotated_handler, stream_handler]
+
+
+def set_queue_handler(handler: QueueHandler) -> None:
+    for current in list(logger.handlers):
+        if isinstance(current, QueueHandler):
+            logger.removeHandler(current)
+    logger.addHandler(handler)
+
+
+def start_listener() -> None:
+    """
+    Очереди и потоки записи основного процесса: записи самого
+    процесса и записи дочерних процессов
+    """
+    global listeners
+    log_queue = queue.SimpleQueue()
+    set_queue_handler(LazyQueueHandler(log_queue))
+    listeners = [
+        QueueListener(queue_, *handlers, respect_handler_level=True)
+        for queue_ in (log_queue, process_queue)
+    ]
+    for listener in listeners:
+        listener.start()
+
+
+def forward_to_parent() -> None:
+    """
+    Дочерний процесс не пишет файл сам: записи уходят основному.
+    QueueHandler форматирует сообщение до отправки - аргументы
+    и исключения не обязаны сериализоваться через pickle.
+    """
+    global listeners
+    listeners = []
+    set_queue_handler(QueueHandler(process_queue))
+
+
+def stop_listener() -> None:
+    """
+    Дописать очередь; вызывается при выходе из процесса.
+    В дочернем процессе записи дописывает поток
+    multiprocessing.Queue при завершении процесса.
+    """
+    global listeners
+    for listener in listeners:
+        listener.stop()
+    listeners = []
+
+
+config = LoggingConfig()
+logger = logging.getLogger("etl")
+logger.setLevel(config.level)
+logger.propagate = False
+handlers = create_handlers()
+process_queue = multiprocessing.get_context("fork").Queue()
+listeners: list[QueueListener] = []
+start_listener()
+atexit.register(stop_listener)
+# Потоки записи не переживают fork: процессы шардов, супервизора
+# и пула валидации пересылают записи основному процессу
+os.register_at_fork(after_in_child=forward_to_parent)
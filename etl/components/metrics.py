@@ -0,0 +1,110 @@
+"""
+Метрики ETL в формате Prometheus, метка index - индекс ModelETL.
+Скорость загрузки считается в Prometheus как
+rate(etl_documents_loaded_total[1m]), для последнего прохода
+есть готовый показатель etl_run_documents_per_second.
+"""
+import time
+from datetime import datetime, timezone
+from typing import Iterator
+
+from prometheus_client import (
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+STAGE_EXTRACT = "extract"
+STAGE_TRANSFORM = "transform"
+STAGE_BULK = "bulk"
+
+STAGE_DURATION = Histogram(
+    "etl_stage_duration_seconds",
+    "Длительность обработки одной пачки на этапе",
+    ["index", "stage"],
+    buckets=(
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+    ),
+)
+QUEUE_DEPTH = Gauge(
+    "etl_queue_depth",
+    "Пачки в очереди между extract и load",
+    ["index"],
+)
+DOCUMENTS_LOADED = Counter(
+    "etl_documents_loaded_total",
+    "Документы, загруженные в Elasticsearch",
+    ["index"],
+)
+RUN_THROUGHPUT = Gauge(
+    "etl_run_documents_per_second",
+    "Скорость загрузки за последний проход индекса",
+    ["index"],
+)
+BATCH_SIZE = Gauge(
+    "etl_batch_size",
+    "Текущий размер пачки при адаптивном подборе",
+    ["index"],
+)
+DOCUMENTS_SKIPPED = Counter(
+    "etl_documents_skipped_total",
+    "Документы, не отправленные из-за совпадения отпечатка содержимого",
+    ["index"],
+)
+BULK_ERRORS = Counter(
+    "etl_bulk_errors_total",
+    "Документы, отклонённые Elasticsearch в ответе _bulk",
+    ["index"],
+)
+VALIDATION_ERRORS = Counter(
+    "etl_validation_errors_total",
+    "Строки postgres, не прошедшие валидацию модели",
+    ["index"],
+)
+BYTES_SENT = Counter(
+    "etl_bulk_bytes_sent_total",
+    "Размер тел запросов _bulk после сжатия",
+    ["index"],
+)
+
+
+class WatermarkLagCollector:
+    """
+    Отставание метки индекса от текущего времени считается
+    в момент опроса, поэтому растёт и между проходами ETL.
+    """
+
+    def __init__(self):
+        self._watermarks: dict[str, float] = {}
+
+    def set(self, index: str, watermark: datetime | str) -> None:
+        if isinstance(watermark, str):
+            watermark = datetime.fromisoformat(watermark)
+        if watermark == datetime.min:
+            return
+        if watermark.tzinfo is None:
+            watermark = watermark.replace(tzinfo=timezone.utc)
+        self._watermarks[index] = watermark.timestamp()
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        lag = GaugeMetricFamily(
+            "etl_watermark_lag_seconds",
+            "Время от метки modified индекса до текущего момента",
+            labels=["index"],
+        )
+        now = time.time()
+        for index, timestamp in self._watermarks.items():
+            lag.add_metric([index], max(now - timestamp, 0))
+        yield lag
+
+
+WATERMARK_LAG = WatermarkLagCollector()
+REGISTRY.register(WATERMARK_LAG)
+
+
+def start_metrics_server(port: int) -> None:
+    """HTTP endpoint /metrics в отдельном потоке"""
+    start_http_server(port)
@@ -1,5 +1,5 @@
-from typing import Optional
 from collections import defaultdict
+from typing import Optional
 from uuid import UUID
 
 from pydantic import BaseModel, BaseSettings, Field, validator
@@ -22,11 +22,16 @@ class Person(BaseModelUUIDMixin):
 
 
 class PersonFilms(Person):
-    films: list = []
+    films: list | dict = []
 
     @validator("films")
     def validate_films(cls, v):
         roles = defaultdict(list)
+        if isinstance(v, dict):
+            # Документ passthrough: фильмы уже сгруппированы по ролям
+            for role, films in v.items():
+                roles[role].extend(Film(**row) for row in films)
+            return roles
         for row in v:
             role = row.pop("role")
             roles[role].append(Film(**row))
@@ -38,6 +43,9 @@ class Film(BaseModelUUIDMixin):
     title: str
     imdb_rating: float
 
+    class Config:
+        allow_population_by_field_name = True
+
 
 class FilmWork(BaseModelUUIDMixin):
     imdb_rating: float
@@ -57,6 +65,40 @@ class ModelETL(BaseSettings):
     index_name: str
     index_schema: dict
     query: str
+    keyset_query: str | None = None
+    changes_queries: list[str] = []
+    enrich_query: str | None = None
+    # Варианты запросов для режима passthrough: имя запроса модели ->
+    # запрос, возвращающий готовый документ в столбце document
+    passthrough_queries: dict[str, str] = {}
+    # Режим fan-out (ETL_FANOUT): документы пересобираются только по
+    # fanout_changes_queries, а строки fanout_queries (id, modified и
+    # параметры) превращаются в обновления скриптом fanout_script
+    fanout_changes_queries: list[str] = []
+    fanout_queries: list[str] = []
+    fanout_script: str | None = None
+    # Первичная загрузка по диапазонам id в ETL_SHARDS процессах:
+    # запрос id диапазона, документы собираются enrich_query
+    shard_query: str | None = None
+    # Режим LISTEN/NOTIFY: "таблица.столбец" из уведомления -> запрос
+    # id документов индекса, None - это и есть id документов
+    notify_queries: dict[str, str | None] = {}
     amount_query_args: int
     model: type[BaseModel]
+    # Начальный размер пачки; при ETL_ADAPTIVE_BATCHING подбирается
+    # в границах min/max_batch_size под целевые длительность и размер
+    # bulk-запроса
     batch_size: int
+    min_batch_size: int = 10
+    max_batch_size: int = 5000
+    target_bulk_latency: float = 1.0
+    target_bulk_bytes: int = 10 * 1024 * 1024
+    # Сколько bulk-запросов индекса выполняется одновременно
+    bulk_workers: int = 2
+    # Сколько готовых пачек может ждать загрузки
+    queue_size: int = 4
+
+    @property
+    def fanout_script_id(self) -> str:
+        """Id сохранённого в Elasticsearch скрипта fanout_script"""
+        return f"{self.index_name}_fanout"
@@ -0,0 +1,52 @@
+import json
+import time
+from collections import defaultdict
+from json import JSONDecodeError
+
+from clients.postgres_client import PostgresListener
+from components.logger import logger
+
+BROKEN_NOTIFICATION = "Пропущено уведомление postgres: {payload}."
+
+# "таблица.столбец" -> id из уведомлений, см. queries.notify_tables
+ChangeSet = dict[str, set[str]]
+
+
+def add_notification(changes: ChangeSet, payload: str) -> None:
+    try:
+        record = json.loads(payload)
+        table = record.pop("table")
+    except (JSONDecodeError, KeyError, TypeError, AttributeError):
+        logger.warning(BROKEN_NOTIFICATION.format(payload=payload))
+        return
+    for column, value in record.items():
+        if value is not None:
+            changes[f"{table}.{column}"].add(str(value))
+
+
+async def collect_changes(
+    listener: PostgresListener,
+    timeout: float,
+    debounce: float,
+    max_wait: float,
+) -> ChangeSet | None:
+    """
+    Ожидание изменений с подавлением дребезга: пачка закрывается после
+    debounce секунд без уведомлений или через max_wait секунд после
+    первого, повторы одного id схлопываются.
+    :param listener: подписка на канал триггеров
+    :param timeout: сколько ждать первое уведомление
+    :return: изменения или None, если за timeout уведомлений не было
+    """
+    payload = await listener.get(timeout)
+    if payload is None:
+        return None
+    changes: ChangeSet = defaultdict(set)
+    add_notification(changes, payload)
+    deadline = time.monotonic() + max_wait
+    while (remaining := deadline - time.monotonic()) > 0:
+        payload = await listener.get(min(debounce, remaining))
+        if payload is None:
+            break
+        add_notification(changes, payload)
+    return dict(changes)
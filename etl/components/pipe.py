@@ -1,16 +1,73 @@
 import asyncio
+import json
 import time
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Executor
 from datetime import datetime
+from typing import NamedTuple
 
 from psycopg2.extras import RealDictRow
-from pydantic import BaseModel
 from pydantic.error_wrappers import ValidationError
 
-from clients.elasticsearch_clients import ElasticsearchAsyncClient
-from clients.postgres_client import PostgresClient, PostgresCursor
-from components.config import AppSettings
+from clients.elasticsearch_clients import (
+    ElasticsearchAsyncClient,
+    ndjson_bulk_chunks,
+)
+from clients.postgres_client import (
+    AsyncPostgresClient,
+    AsyncPostgresCursor,
+    PostgresPool,
+)
+from components import metrics
+from components.batching import AdaptiveBatchSize
+from components.config import AppSettings, dead_letters_path
+from components.deadletter import DeadLetterStore
+from components.fingerprints import FingerprintCache, fingerprint
+from components.logger import IdList, SummaryLimiter
 from components.models import ModelETL
+from components.notify import ChangeSet
+from components.tracking import STAGE_LOAD, STAGE_VALIDATION, IndexTracker
+from components.transform import compact_rows, transform_rows, validate_rows
+
+# Сообщения пачек форматируются логгером лениво, в потоке записи
+DEAD_LETTERS_MISSING = (
+    "Документы %s индекса %s из dead-letter файлов "
+    "не найдены в postgres и сняты с повторной выгрузки"
+)
+DOCUMENTS_SKIPPED = "Не отправлено %d неизменившихся документов индекса %s"
+BATCH_LOADED = "Загружено в ES %d объектов индекса %s за %.2f сек."
+BATCH_VALIDATED = "Успешно загружено %d объектов индекса %s за %.2f сек."
+LOAD_ERRORS = (
+    "Произошла ошибка при загрузке документов в индекс %s Elasticsearch. "
+    "Документы с ошибкой: %s, сводок пропущено: %d. Подробности: %s"
+)
+VALIDATION_ERRORS = (
+    "Произошла ошибка при валидации объектов индекса %s из Postgres. "
+    "Документы с ошибкой: %s, сводок пропущено: %d. Подробности: %s"
+)
+# Очередь записи Elasticsearch переполнена - нужно снизить нагрузку
+REJECTED_ERROR = "es_rejected_execution_exception"
+
+FIRST_PAGE_CURSOR = {
+    "cursor_modified": datetime.min.isoformat(),
+    "cursor_id": "00000000-0000-0000-0000-000000000000",
+}
+
+
+class Batch(NamedTuple):
+    # Пары (id, документ); документ - dict или готовый json-текст
+    documents: list[tuple[str, dict | str]]
+    # Метка, которую можно сохранить после подтверждения пачки:
+    # все строки с modified <= watermark уже выгружены этой или
+    # предыдущими пачками. None - в пачке одно значение modified
+    watermark: datetime | None
+    # None - пачка из уведомлений, метка не сдвигается
+    last_modified: datetime | None
+    # index - документы целиком, update - частичные обновления fan-out
+    action: str = "index"
+    # Отпечатки отправленных документов, сохраняются после подтверждения
+    fingerprints: dict[str, bytes] | None = None
 
 
 class AbstractETLInterface(ABC):
@@ -31,62 +88,613 @@ class Pipe(AbstractETLInterface):
     def __init__(
         self,
         elastic_conn: ElasticsearchAsyncClient,
-        last_modified: datetime,
         model_params: ModelETL,
-        pg_conn: PostgresClient,
+        pg_pool: PostgresPool,
         settings: AppSettings,
+        target_index: str | None = None,
+        transform_pool: Executor | None = None,
+        changes: ChangeSet | None = None,
+        fingerprints: FingerprintCache | None = None,
+        retry_dead_letters: bool = False,
+        dead_letters: DeadLetterStore | None = None,
     ):
+        """
+        :param dead_letters: dead-letter файлы индекса, общие для pipe
+            процесса; без них pipe открывает файлы сам
+        """
         self.model_params = model_params
+        # Индекс для записи: при переиндексации - новая версия индекса
+        self.target_index = target_index or model_params.index_name
         self.settings = settings
         self._elastic_conn = elastic_conn
+        self.watermark_key = f"{self.target_index}_modified"
+        self._last_modified = self.get_watermark()
+        if self.target_index == model_params.index_name:
+            metrics.WATERMARK_LAG.set(self.target_index, self._last_modified)
         self._query_args: tuple = (
-            last_modified,
+            self._last_modified,
         ) * model_params.amount_query_args
-        self._Queue: asyncio.Queue = asyncio.Queue(maxsize=1)
-        self._pg_conn = pg_conn
+        self._Queue: asyncio.Queue = asyncio.Queue(
+            maxsize=model_params.queue_size
+        )
+        self._pg_pool = pg_pool
+        self.passthrough = settings.etl_settings.passthrough and bool(
+            model_params.passthrough_queries
+        )
+        self._rows_seen = 0
+        # Документы passthrough не разбираются - отдавать их в процессы
+        # дороже, чем проверить выборку на месте
+        self._transform_pool = None if self.passthrough else transform_pool
+        # Изменения из уведомлений postgres: выгружаются только
+        # затронутые документы, метка индекса не сдвигается
+        self.changes = changes
+        self._labels = {"index": model_params.index_name}
+        # Сводки ошибок пачек - не чаще раза в LOG_SUMMARY_INTERVAL,
+        # полный список остаётся в dead-letter файлах
+        self._error_summaries = SummaryLimiter()
+        self.fingerprints = fingerprints
+        self._skipped = 0
+        # Fan-out только для инкрементальной выгрузки в рабочий индекс:
+        # при первой загрузке и переиндексации документы собираются целиком
+        self.fanout = (
+            settings.etl_settings.fanout
+            and bool(model_params.fanout_queries)
+            and self.target_index == model_params.index_name
+            and self._last_modified != datetime.min
+        )
+        # Начало выгрузки текущей пачки без ожидания места в очереди
+        self._extract_started = time.monotonic()
+        self._loaded = 0
+        self.batch_size_key = f"{model_params.index_name}_batch_size"
+        self.batch_sizer = None
+        if settings.etl_settings.adaptive_batching:
+            # Подобранный размер переживает перезапуск
+            self.batch_sizer = AdaptiveBatchSize(
+                initial=settings.storage.get_state(self.batch_size_key)
+                or model_params.batch_size,
+                min_size=model_params.min_batch_size,
+                max_size=model_params.max_batch_size,
+                target_latency=model_params.target_bulk_latency,
+                target_bytes=model_params.target_bulk_bytes,
+            )
+        self.dead_letters = dead_letters
+        self.tracker = self.create_tracker()
+        # Режим retry-dead-letters: выгружаются только документы
+        # из dead-letter файлов, метка индекса не сдвигается
+        self.retry_ids = (
+            [letter.id for letter in self.tracker.dead_letters.pending()]
+            if retry_dead_letters
+            else None
+        )
+
+    def create_tracker(self) -> IndexTracker:
+        etl_settings = self.settings.etl_settings
+        if self.dead_letters is None:
+            self.dead_letters = DeadLetterStore(
+                directory=dead_letters_path,
+                index_name=self.model_params.index_name,
+                segment_size=etl_settings.dead_letter_segment_size,
+                max_errors=etl_settings.errors_max_size,
+                retention=etl_settings.errors_retention,
+            )
+        return IndexTracker(
+            index_name=self.model_params.index_name,
+            storage=self.settings.storage,
+            dead_letters=self.dead_letters,
+        )
 
     async def extract(self) -> None:
-        with self._pg_conn.cursor() as cur:
-            cur: PostgresCursor
-            cur.execute(self.model_params.query, self._query_args)
-            while data := cur.fetchmany(self.model_params.batch_size):
+        pagination = self.settings.etl_settings.pagination
+        self._extract_started = time.monotonic()
+        async with self._pg_pool.connection() as pg_conn:
+            if self.retry_ids is not None:
+                await self.extract_dead_letters(pg_conn)
+            elif self.changes is not None:
+                await self.extract_changes(pg_conn)
+            elif pagination != "stream" and self.model_params.changes_queries:
+                await self.extract_staged(pg_conn)
+            elif pagination != "stream" and self.model_params.keyset_query:
+                await self.extract_pages(pg_conn)
+            else:
+                await self.extract_stream(pg_conn)
+        await self._Queue.put(None)
+
+    async def extract_stream(self, pg_conn: AsyncPostgresClient) -> None:
+        """Один запрос на всю дельту, чтение пачками из курсора"""
+        pg_settings = self.settings.pg_settings
+        async with pg_conn.cursor(
+            name=(
+                f"etl_{self.model_params.index_name}"
+                if pg_settings.server_side_cursors
+                else None
+            ),
+            itersize=pg_settings.itersize,
+        ) as cur:
+            cur: AsyncPostgresCursor
+            await cur.execute(self.get_query("query"), self._query_args)
+            while data := await cur.fetchmany(self.batch_size):
                 data: list[RealDictRow]
-                await self._Queue.put(self.transform(rows=data))
-            await self._Queue.put(None)
+                await self.put_batch(data)
 
-    async def load(self) -> None:
-        while data := await self._Queue.get():
-            data: list[RealDictRow]
-            start = time.time()
-            documents = [
+    async def extract_pages(self, pg_conn: AsyncPostgresClient) -> None:
+        """
+        Keyset-пагинация по (modified, id): каждая страница - отдельный
+        короткий запрос на batch_size строк в своей транзакции.
+        """
+        cursor = FIRST_PAGE_CURSOR
+        while True:
+            batch_size = self.batch_size
+            async with pg_conn.cursor() as cur:
+                await cur.execute(
+                    self.get_query("keyset_query"),
+                    {
+                        "since": self._last_modified,
+                        "limit": batch_size,
+                        **cursor,
+                    },
+                )
+                data = await cur.fetchmany(batch_size)
+            if not data:
+                break
+            cursor = {
+                "cursor_modified": data[-1]["modified"].isoformat(),
+                "cursor_id": str(data[-1]["id"]),
+            }
+            await self.put_batch(data)
+
+    async def extract_staged(self, pg_conn: AsyncPostgresClient) -> None:
+        """
+        Двухэтапная выгрузка: id изменённых объектов собираются
+        отдельными запросами по каждой таблице-источнику, затем документы
+        собираются пачками по batch_size id. Стоимость инкрементального
+        запуска пропорциональна числу изменений, а не размеру каталога.
+        Запросы первого этапа читают один снимок данных: изменение,
+        закоммиченное между ними, не сдвинет метку мимо себя.
+        """
+        changed: dict[str, datetime] = {}
+        updates: list[Batch] = []
+        changes_queries = (
+            self.model_params.fanout_changes_queries
+            if self.fanout
+            else self.model_params.changes_queries
+        )
+        async with pg_conn.snapshot():
+            for query in changes_queries:
+                async with pg_conn.cursor() as cur:
+                    await cur.execute(query, {"since": self._last_modified})
+                    while rows := await cur.fetchmany(
+                        self.settings.pg_settings.itersize
+                    ):
+                        for row in rows:
+                            doc_id = str(row["id"])
+                            previous = changed.get(doc_id)
+                            if previous is None or row["modified"] > previous:
+                                changed[doc_id] = row["modified"]
+            if self.fanout:
+                updates = await self.extract_fanout(pg_conn, changed)
+        # Очередь может ждать загрузчик, поэтому пачки кладутся в неё
+        # после завершения транзакции, чтобы не держать снимок
+        for batch in updates:
+            pending = asyncio.get_running_loop().create_future()
+            pending.set_result(batch)
+            await self._Queue.put(pending)
+        ordered = sorted(changed, key=lambda doc_id: (changed[doc_id], doc_id))
+        await self.extract_by_ids(pg_conn, ordered, changed)
+
+    async def extract_fanout(
+        self, pg_conn: AsyncPostgresClient, changed: dict[str, datetime]
+    ) -> list[Batch]:
+        """
+        Переименования персон и жанров превращаются в частичные
+        обновления фильмов скриптом fanout_script вместо пересборки
+        документов. Фильмы из changed и так собираются целиком,
+        для них учитывается только modified.
+        Пачки обновлений идут в очередь раньше пересборки, метку
+        сдвигает только последняя пачка выгрузки.
+        """
+        updates: dict[str, dict] = {}
+        last_modified = None
+        for query in self.model_params.fanout_queries:
+            async with pg_conn.cursor() as cur:
+                await cur.execute(query, {"since": self._last_modified})
+                while rows := await cur.fetchmany(
+                    self.settings.pg_settings.itersize
+                ):
+                    for row in rows:
+                        doc_id = str(row["id"])
+                        if doc_id in changed:
+                            changed[doc_id] = self.latest(
+                                changed[doc_id], row["modified"]
+                            )
+                            continue
+                        last_modified = self.latest(
+                            last_modified, row["modified"]
+                        )
+                        params = updates.setdefault(doc_id, {})
+                        for key, value in row.items():
+                            if key not in ("id", "modified"):
+                                params[key] = value
+        documents = [
+            (
+                doc_id,
                 {
-                    "_index": self.model_params.index_name,
-                    "_id": row.id,
-                    "_source": row.dict(),
-                }
-                for row in data
-            ]
-            success, errors = await self._elastic_conn.bulk(
-                actions=documents,
-                index=self.model_params.index_name,
-                chunk_size=self.model_params.batch_size,
+                    "script": {
+                        "id": self.model_params.fanout_script_id,
+                        "params": params,
+                    }
+                },
             )
-            self.save_load_results(errors, start, success)
+            for doc_id, params in sorted(updates.items())
+        ]
+        return [
+            Batch(
+                documents[start:start + self.batch_size],
+                None,
+                last_modified,
+                action="update",
+            )
+            for start in range(0, len(documents), self.batch_size)
+        ]
+
+    async def extract_changes(self, pg_conn: AsyncPostgresClient) -> None:
+        """Документы, затронутые изменениями из уведомлений postgres"""
+        ids: set[str] = set()
+        for key, query in self.model_params.notify_queries.items():
+            changed = self.changes.get(key)
+            if not changed:
+                continue
+            if query is None:
+                ids.update(changed)
+                continue
+            async with pg_conn.cursor() as cur:
+                await cur.execute(query, {"ids": sorted(changed)})
+                while rows := await cur.fetchmany(
+                    self.settings.pg_settings.itersize
+                ):
+                    ids.update(str(row["id"]) for row in rows)
+        await self.extract_by_ids(pg_conn, sorted(ids))
 
-    def transform(self, rows: list[RealDictRow]) -> list[BaseModel]:
+    async def extract_dead_letters(self, pg_conn: AsyncPostgresClient) -> None:
+        """Документы из dead-letter файлов, удалённые снимаются с учёта"""
+        start = 0
+        while start < len(self.retry_ids):
+            ids = self.retry_ids[start:start + self.batch_size]
+            start += len(ids)
+            data = await self.fetch_by_ids(pg_conn, ids)
+            found = {str(row["id"]) for row in data}
+            missing = [doc_id for doc_id in ids if doc_id not in found]
+            if missing:
+                self.tracker.dead_letters.resolve(missing)
+                self.settings.logger.warning(
+                    DEAD_LETTERS_MISSING,
+                    IdList(missing),
+                    self.model_params.index_name,
+                    extra={
+                        "index": self.model_params.index_name,
+                        "ids_count": len(missing),
+                    },
+                )
+            if data:
+                await self.put_batch(data)
+
+    async def extract_by_ids(
+        self,
+        pg_conn: AsyncPostgresClient,
+        ordered: list[str],
+        changed: dict[str, datetime] | None = None,
+    ) -> None:
+        """
+        Сборка документов пачками по batch_size id.
+        :param ordered: id документов в порядке выгрузки
+        :param changed: modified по id для метки индекса
+        """
+        start = 0
+        while start < len(ordered):
+            batch_size = self.batch_size
+            ids = ordered[start:start + batch_size]
+            start += batch_size
+            data = await self.fetch_by_ids(pg_conn, ids)
+            if changed:
+                for row in data:
+                    row["modified"] = changed[str(row["id"])]
+            if data:
+                await self.put_batch(data)
+
+    async def fetch_by_ids(
+        self, pg_conn: AsyncPostgresClient, ids: list[str]
+    ) -> list[RealDictRow]:
+        """Строки enrich_query в порядке ids"""
+        async with pg_conn.cursor() as cur:
+            await cur.execute(self.get_query("enrich_query"), {"ids": ids})
+            rows = {
+                str(row["id"]): row for row in await cur.fetchmany(len(ids))
+            }
+        # Объект мог быть удалён между этапами
+        return [rows[doc_id] for doc_id in ids if doc_id in rows]
+
+    async def put_batch(self, rows: list[RealDictRow]) -> None:
+        """
+        В очередь ставится ожидание пачки в порядке выгрузки.
+        С пулом процессов преобразование идёт параллельно
+        с дальнейшей выгрузкой, и несколько пачек обрабатываются
+        одновременно; load дожидается их строго по порядку.
+        """
+        metrics.STAGE_DURATION.labels(
+            stage=metrics.STAGE_EXTRACT, **self._labels
+        ).observe(time.monotonic() - self._extract_started)
+        if self._transform_pool is None:
+            pending = asyncio.get_running_loop().create_future()
+            pending.set_result(self.make_batch(rows))
+        else:
+            pending = asyncio.create_task(self.make_batch_in_pool(rows))
+        await self._Queue.put(pending)
+        metrics.QUEUE_DEPTH.labels(**self._labels).set(self._Queue.qsize())
+        self._extract_started = time.monotonic()
+
+    def make_batch(self, rows: list[RealDictRow]) -> Batch:
+        return Batch(self.transform(rows=rows), *self.batch_bounds(rows))
+
+    async def make_batch_in_pool(self, rows: list[RealDictRow]) -> Batch:
         start = time.time()
-        result, errors, success_id, = (
-            [],
-            {},
-            set(),
+        bounds = self.batch_bounds(rows)
+        with metrics.STAGE_DURATION.labels(
+            stage=metrics.STAGE_TRANSFORM, **self._labels
+        ).time():
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._transform_pool,
+                transform_rows,
+                self.model_params.model,
+                compact_rows(rows),
+            )
+        self.save_validation_results(
+            result.errors,
+            start,
+            result.success_ids,
+            self.failed_rows(rows, result.errors),
+        )
+        return Batch(result.documents, *bounds)
+
+    def batch_bounds(
+        self, rows: list[RealDictRow]
+    ) -> tuple[datetime | None, datetime | None]:
+        """Строки приходят отсортированными по modified"""
+        if self.changes is not None or self.retry_ids is not None:
+            return None, None
+        last_modified = rows[-1]["modified"]
+        watermark = max(
+            (
+                row["modified"]
+                for row in rows
+                if row["modified"] < last_modified
+            ),
+            default=None,
         )
+        return watermark, last_modified
+
+    def get_watermark(self) -> datetime | str:
+        """Метка индекса, для первого запуска - общая метка старых версий"""
+        watermark = self.settings.storage.get_state(self.watermark_key)
+        if not watermark and self.target_index == self.model_params.index_name:
+            watermark = self.settings.storage.get_state("modified")
+        return watermark or datetime.min
+
+    def set_watermark(self, modified: datetime) -> None:
+        self.settings.storage.set_state(
+            self.watermark_key, modified.isoformat(), sync=True
+        )
+        if self.target_index == self.model_params.index_name:
+            metrics.WATERMARK_LAG.set(self.target_index, modified)
+
+    async def load(self) -> None:
+        """
+        До bulk_workers bulk-запросов индекса выполняются одновременно,
+        а результаты и метка фиксируются строго в порядке пачек.
+        """
+        in_flight: deque[tuple[Batch, asyncio.Task]] = deque()
+        last_modified = None
+        try:
+            while pending := await self._Queue.get():
+                metrics.QUEUE_DEPTH.labels(**self._labels).set(
+                    self._Queue.qsize()
+                )
+                batch: Batch = self.skip_unchanged(await pending)
+                task = asyncio.create_task(self.send(batch))
+                in_flight.append((batch, task))
+                if len(in_flight) >= self.model_params.bulk_workers:
+                    last_modified = self.latest(
+                        last_modified,
+                        await self.acknowledge(*in_flight.popleft()),
+                    )
+            while in_flight:
+                last_modified = self.latest(
+                    last_modified,
+                    await self.acknowledge(*in_flight.popleft()),
+                )
+        finally:
+            for _, task in in_flight:
+                task.cancel()
+            while not self._Queue.empty():
+                if pending := self._Queue.get_nowait():
+                    pending.cancel()
+            metrics.QUEUE_DEPTH.labels(**self._labels).set(0)
+        if self._skipped:
+            self.settings.logger.info(
+                DOCUMENTS_SKIPPED,
+                self._skipped,
+                self.target_index,
+                extra={"index": self.target_index, "skipped": self._skipped},
+            )
+        if last_modified:
+            # Выгрузка завершена - строки с последним modified тоже загружены
+            self.set_watermark(last_modified)
+
+    def skip_unchanged(self, batch: Batch) -> Batch:
+        """Документы с сохранённым отпечатком не отправляются"""
+        if self.fingerprints is None or batch.action != "index":
+            return batch
+        digests = {
+            doc_id: fingerprint(source) for doc_id, source in batch.documents
+        }
+        unchanged = self.fingerprints.unchanged(self.target_index, digests)
+        if unchanged:
+            self._skipped += len(unchanged)
+            metrics.DOCUMENTS_SKIPPED.labels(**self._labels).inc(
+                len(unchanged)
+            )
+        return batch._replace(
+            documents=[
+                (doc_id, source)
+                for doc_id, source in batch.documents
+                if doc_id not in unchanged
+            ],
+            fingerprints={
+                doc_id: digest
+                for doc_id, digest in digests.items()
+                if doc_id not in unchanged
+            },
+        )
+
+    @staticmethod
+    def latest(*values: datetime | None) -> datetime | None:
+        return max((value for value in values if value), default=None)
+
+    @property
+    def batch_size(self) -> int:
+        """Размер следующей пачки выгрузки и bulk-запроса"""
+        if self.batch_sizer:
+            return self.batch_sizer.size
+        return self.model_params.batch_size
+
+    async def send(self, batch: Batch) -> tuple[int, list, float]:
+        start = time.time()
+        success, errors, body_bytes = 0, [], 0
+        bulk_start = time.time()
+        # Тела собираются сразу в байты: без промежуточных action-словарей
+        # и повторной сериализации документов внутри helpers.bulk.
+        # Пачка делится на запросы не больше bulk_max_bytes
+        for body, count in ndjson_bulk_chunks(
+            batch.documents,
+            self.settings.es_settings.bulk_max_bytes,
+            action_type=batch.action,
+        ):
+            payload = await self._elastic_conn.compress(body)
+            with metrics.STAGE_DURATION.labels(
+                stage=metrics.STAGE_BULK, **self._labels
+            ).time():
+                try:
+                    (
+                        chunk_success,
+                        chunk_errors,
+                    ) = await self._elastic_conn.bulk_ndjson(
+                        body=payload, index=self.target_index, count=count
+                    )
+                except Exception:
+                    self.adapt_batch_size(rejected=True)
+                    raise
+            metrics.BYTES_SENT.labels(**self._labels).inc(len(payload))
+            success += chunk_success
+            errors.extend(chunk_errors)
+            body_bytes += len(body)
+        self.adapt_batch_size(
+            rejected=any(
+                REJECTED_ERROR in str(operation.get("error"))
+                for error in errors
+                for operation in error.values()
+            ),
+            documents=len(batch.documents),
+            latency=time.time() - bulk_start,
+            body_bytes=body_bytes,
+        )
+        return success, errors, start
+
+    def adapt_batch_size(
+        self,
+        rejected: bool,
+        documents: int = 0,
+        latency: float = 0,
+        body_bytes: int = 0,
+    ) -> None:
+        if not self.batch_sizer:
+            return
+        if rejected:
+            self.batch_sizer.backoff()
+        else:
+            self.batch_sizer.observe(documents, latency, body_bytes)
+        metrics.BATCH_SIZE.labels(**self._labels).set(self.batch_sizer.size)
+
+    async def acknowledge(self, batch: Batch, task: asyncio.Task) -> datetime:
+        success, errors, start = await task
+        failed = self.save_load_results(
+            errors, start, success, dict(batch.documents)
+        )
+        if self.fingerprints is not None:
+            if batch.fingerprints is not None:
+                self.fingerprints.update(
+                    self.target_index,
+                    {
+                        doc_id: digest
+                        for doc_id, digest in batch.fingerprints.items()
+                        if doc_id not in failed
+                    },
+                )
+            elif batch.action != "index":
+                # Документ изменён частично - отпечаток устарел
+                self.fingerprints.discard(
+                    self.target_index,
+                    (doc_id for doc_id, _ in batch.documents),
+                )
+        if batch.watermark:
+            self.set_watermark(batch.watermark)
+        return batch.last_modified
+
+    def get_query(self, name: str) -> str:
+        """Запрос модели с учётом режима passthrough"""
+        if self.passthrough:
+            return self.model_params.passthrough_queries[name]
+        return getattr(self.model_params, name)
+
+    def transform(
+        self, rows: list[RealDictRow]
+    ) -> list[tuple[str, dict | str]]:
+        with metrics.STAGE_DURATION.labels(
+            stage=metrics.STAGE_TRANSFORM, **self._labels
+        ).time():
+            if self.passthrough:
+                return self.transform_documents(rows)
+            start = time.time()
+            result = validate_rows(self.model_params.model, rows)
+            self.save_validation_results(
+                result.errors,
+                start,
+                result.success_ids,
+                self.failed_rows(rows, result.errors),
+            )
+            return result.documents
+
+    def transform_documents(
+        self, rows: list[RealDictRow]
+    ) -> list[tuple[str, str]]:
+        """
+        Режим passthrough: документ уже собран в postgres и уходит
+        в Elasticsearch без разбора. С моделью сверяется только
+        каждый validation_sample-й документ.
+        """
+        start = time.time()
+        sample = self.settings.etl_settings.validation_sample
+        result, errors, success_id = [], {}, set()
         for row in rows:
-            try:
-                result.append(self.model_params.model(**row))
-                success_id.add(row["id"])
-            except ValidationError as err:
-                errors[row["id"]] = str(err)
-        self.save_validation_results(errors, start, success_id)
+            self._rows_seen += 1
+            if sample and self._rows_seen % sample == 0:
+                try:
+                    self.model_params.model(**json.loads(row["document"]))
+                except ValidationError as err:
+                    errors[row["id"]] = str(err)
+                    continue
+            result.append((str(row["id"]), row["document"]))
+            success_id.add(row["id"])
+        self.save_validation_results(
+            errors, start, success_id, self.failed_rows(rows, errors)
+        )
         return result
 
     @property
@@ -95,59 +703,100 @@ class Pipe(AbstractETLInterface):
         consumer = asyncio.create_task(self.load())
         return producer, consumer
 
-    def save_load_results(self, errors, start, success):
-        errors = errors.union(
-            self.settings.storage.get_state(
-                f"{self.model_params.index_name}_elastic_errors"
+    async def run(self) -> None:
+        """Запуск extract и load; при ошибке одного второй отменяется"""
+        start = time.monotonic()
+        tasks = await self.tasks
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        if self.batch_sizer:
+            self.settings.storage.set_state(
+                self.batch_size_key, self.batch_sizer.size
             )
-            or set()
-        )
-        self.settings.storage.set_state(
-            f"{self.model_params.index_name}_elastic_errors", list(errors)
+        if self._loaded:
+            metrics.RUN_THROUGHPUT.labels(**self._labels).set(
+                self._loaded / (time.monotonic() - start)
+            )
+
+    @staticmethod
+    def failed_rows(rows: list[RealDictRow], errors: dict) -> dict:
+        """Исходные строки документов с ошибками для dead-letter"""
+        if not errors:
+            return {}
+        return {row["id"]: row for row in rows if row["id"] in errors}
+
+    def save_load_results(self, errors, start, success, documents) -> dict:
+        errors = {
+            item["_id"]: item.get("error", item.get("status"))
+            for error in errors
+            for item in error.values()
+        }
+        self.tracker.record_load(
+            {doc_id for doc_id in documents if str(doc_id) not in errors},
+            errors,
+            {doc_id: documents.get(doc_id) for doc_id in errors},
         )
+        self._loaded += success
+        metrics.DOCUMENTS_LOADED.labels(**self._labels).inc(success)
+        metrics.BULK_ERRORS.labels(**self._labels).inc(len(errors))
         if errors:
-            self.settings.logger.error(
-                (
-                    f"Произошла ошибка при загрузке документов в индекс "
-                    f"{self.model_params.index_name} Elasticsearch. Документы с ошибкой: "
-                    f"{list(errors)}. Подробности: etl_status/state.json"
-                )
-            )
-        duration = round(time.time() - start, 2)
+            self.log_errors(LOAD_ERRORS, STAGE_LOAD, errors)
+        duration = time.time() - start
         self.settings.logger.info(
-            f"Загружено в ES {success} объектов индекса "
-            f"{self.model_params.index_name} за {duration} сек."
+            BATCH_LOADED,
+            success,
+            self.model_params.index_name,
+            duration,
+            extra={
+                "index": self.model_params.index_name,
+                "stage": STAGE_LOAD,
+                "documents": success,
+                "duration": duration,
+            },
         )
+        return errors
 
-    def save_validation_results(self, errors, start, success_id):
-        errors |= (
-            self.settings.storage.get_state(
-                f"{self.model_params.index_name}_pgsql_errors"
-            )
-            or {}
-        )
-        self.settings.storage.set_state(
-            f"{self.model_params.index_name}_pgsql_errors", errors
-        )
-        success = success_id.union(
-            self.settings.storage.get_state(
-                f"{self.model_params.index_name}_pgsql_success"
-            )
-            or set()
-        )
-        self.settings.storage.set_state(
-            f"{self.model_params.index_name}_pgsql_success", list(success)
-        )
-        duration = round(time.time() - start, 2)
+    def save_validation_results(
+        self, errors, start, success_id, payloads=None
+    ):
+        self.tracker.record_validation(success_id, errors, payloads)
+        metrics.VALIDATION_ERRORS.labels(**self._labels).inc(len(errors))
+        duration = time.time() - start
         self.settings.logger.info(
-            f"Успешно загружено {len(success)} объектов индекса {self.model_params.index_name} "
-            f"за {duration} сек."
+            BATCH_VALIDATED,
+            len(success_id),
+            self.model_params.index_name,
+            duration,
+            extra={
+                "index": self.model_params.index_name,
+                "stage": STAGE_VALIDATION,
+                "documents": len(success_id),
+                "duration": duration,
+            },
         )
         if errors:
-            self.settings.logger.error(
-                (
-                    f"Произошла ошибка при валидации объектов индекса "
-                    f"{self.model_params.index_name} из Postgres."
-                    f"{list(errors.keys())}. Подробности: etl_status/state.json"
-                ),
-            )
+            self.log_errors(VALIDATION_ERRORS, STAGE_VALIDATION, errors)
+
+    def log_errors(self, message: str, stage: str, errors: dict) -> None:
+        """Сводка ошибок пачки с ограничением частоты по этапу"""
+        suppressed = self._error_summaries.allow(stage)
+        if suppressed is None:
+            return
+        index = self.model_params.index_name
+        self.settings.logger.error(
+            message,
+            index,
+            IdList(errors),
+            suppressed,
+            dead_letters_path / index,
+            extra={
+                "index": index,
+                "stage": stage,
+                "errors_count": len(errors),
+                "suppressed": suppressed,
+            },
+        )
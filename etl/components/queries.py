@@ -1,6 +1,7 @@
-last_modified_films_query = """
+films_select_query = """
 SELECT
     fw.id,
+    GREATEST(fw.modified, MAX(p.modified), MAX(g.modified)) AS modified,
     fw.rating AS imdb_rating,
     COALESCE (
         json_agg(
@@ -63,24 +64,88 @@ LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
 LEFT JOIN content.person p ON p.id = pfw.person_id
 LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
 LEFT JOIN content.genre g ON gfw.genre_id = g.id
+"""
+
+last_modified_films_query = films_select_query + """
 WHERE fw.modified > %s OR p.modified > %s OR g.modified > %s
 GROUP BY fw.id
-ORDER BY fw.modified ASC;
+ORDER BY modified ASC;
+"""
+
+# Двухэтапная выгрузка фильмов: сначала id изменённых фильмов
+# отдельным запросом по каждой таблице-источнику (каждый использует
+# индекс по modified своей таблицы), затем сборка документов по id
+changed_films_queries = [
+    """
+SELECT fw.id, fw.modified
+FROM content.film_work fw
+WHERE fw.modified > %(since)s;
+""",
+    """
+SELECT pfw.film_work_id AS id, MAX(p.modified) AS modified
+FROM content.person p
+JOIN content.person_film_work pfw ON pfw.person_id = p.id
+WHERE p.modified > %(since)s
+GROUP BY pfw.film_work_id;
+""",
+    """
+SELECT gfw.film_work_id AS id, MAX(g.modified) AS modified
+FROM content.genre g
+JOIN content.genre_film_work gfw ON gfw.genre_id = g.id
+WHERE g.modified > %(since)s
+GROUP BY gfw.film_work_id;
+""",
+]
+
+# Режим fan-out: изменения персон и жанров не пересобирают фильм,
+# а применяются к документу частичным обновлением. Запросы
+# возвращают id фильма, modified и новые имена {id: имя}
+changed_films_fanout_queries = [
+    """
+SELECT pfw.film_work_id AS id, MAX(p.modified) AS modified,
+       JSONB_OBJECT_AGG(p.id, p.full_name) AS persons
+FROM content.person p
+JOIN content.person_film_work pfw ON pfw.person_id = p.id
+WHERE p.modified > %(since)s
+GROUP BY pfw.film_work_id;
+""",
+    """
+SELECT gfw.film_work_id AS id, MAX(g.modified) AS modified,
+       JSONB_OBJECT_AGG(g.id, g.name) AS genres
+FROM content.genre g
+JOIN content.genre_film_work gfw ON gfw.genre_id = g.id
+WHERE g.modified > %(since)s
+GROUP BY gfw.film_work_id;
+""",
+]
+
+films_by_id_query = films_select_query + """
+WHERE fw.id = ANY(%(ids)s::uuid[])
+GROUP BY fw.id;
 """
 
-last_modified_genres_query = """
-SELECT g.id, 
-	   g.name, 
+genres_select_query = """
+SELECT g.id,
+	   g.modified,
+	   g.name,
 	   g.description
 FROM content.genre as g
+"""
+
+last_modified_genres_query = genres_select_query + """
 WHERE g.modified > %s
 ORDER BY g.modified ASC;
+"""
 
-;
+keyset_genres_query = genres_select_query + """
+WHERE g.modified > %(since)s
+  AND (g.modified, g.id) > (%(cursor_modified)s, %(cursor_id)s)
+ORDER BY g.modified, g.id
+LIMIT %(limit)s;
 """
 
-last_modified_persons_films_query = """
-SELECT p.id, p.full_name, COALESCE (
+persons_films_select_query = """
+SELECT p.id, p.modified, p.full_name, COALESCE (
        JSON_AGG(
            DISTINCT JSONB_BUILD_OBJECT(
                'uuid', fw.id,
@@ -94,8 +159,209 @@ SELECT p.id, p.full_name, COALESCE (
 FROM content.person as p
 LEFT JOIN content.person_film_work as pf on p.id = pf.person_id
 LEFT JOIN content.film_work as fw on pf.film_work_id = fw.id
-WHERE p.modified > %s 
+"""
+
+persons_delta_filter = """
+WHERE p.modified > %s
 GROUP BY p.id
-ORDER BY p.modified ASC
-;
+ORDER BY p.modified ASC;
+"""
+
+persons_keyset_filter = """
+WHERE p.modified > %(since)s
+  AND (p.modified, p.id) > (%(cursor_modified)s, %(cursor_id)s)
+GROUP BY p.id
+ORDER BY p.modified, p.id
+LIMIT %(limit)s;
+"""
+
+last_modified_persons_films_query = (
+    persons_films_select_query + persons_delta_filter
+)
+
+keyset_persons_films_query = persons_films_select_query + persons_keyset_filter
+
+# Режим passthrough: запрос сразу возвращает итоговый документ
+# Elasticsearch текстом в столбце document, ETL передаёт его как есть
+
+# Фильмы персоны сгруппированы по ролям, как в PersonFilms.validate_films
+persons_documents_select_query = """
+SELECT p.id, p.modified, JSONB_BUILD_OBJECT(
+    'id', p.id,
+    'full_name', p.full_name,
+    'films', COALESCE((
+        SELECT JSONB_OBJECT_AGG(roles.role, roles.films)
+        FROM (
+            SELECT pf.role, JSONB_AGG(
+                DISTINCT JSONB_BUILD_OBJECT(
+                    'id', fw.id,
+                    'title', fw.title,
+                    'imdb_rating', fw.rating
+                )
+            ) AS films
+            FROM content.person_film_work as pf
+            JOIN content.film_work as fw on pf.film_work_id = fw.id
+            WHERE pf.person_id = p.id
+            GROUP BY pf.role
+        ) AS roles
+    ), '{}')
+)::text AS document
+FROM content.person as p
+"""
+
+last_modified_persons_documents_query = (
+    persons_documents_select_query + persons_delta_filter
+)
+
+keyset_persons_documents_query = (
+    persons_documents_select_query + persons_keyset_filter
+)
+
+
+def as_document_query(
+    query: str, order_by: str = "", defaults: str = "{}"
+) -> str:
+    """
+    Обёртка над запросом модели: все столбцы строки, кроме modified,
+    собираются в документ Elasticsearch.
+    :param query: запрос модели
+    :param order_by: сортировка результата, если она важна
+    :param defaults: json значений по умолчанию, которых нет в запросе
+    """
+    return f"""
+SELECT docs.id, docs.modified, (
+    '{defaults}'::jsonb || (TO_JSONB(docs) - 'modified')
+)::text AS document
+FROM ({query.strip().rstrip(";")}) AS docs
+{order_by};
 """
+
+
+films_documents_defaults = '{"age_limit": 18}'
+
+last_modified_films_documents_query = as_document_query(
+    last_modified_films_query,
+    order_by="ORDER BY docs.modified",
+    defaults=films_documents_defaults,
+)
+
+films_documents_by_id_query = as_document_query(
+    films_by_id_query, defaults=films_documents_defaults
+)
+
+last_modified_genres_documents_query = as_document_query(
+    last_modified_genres_query, order_by="ORDER BY docs.modified"
+)
+
+keyset_genres_documents_query = as_document_query(
+    keyset_genres_query, order_by="ORDER BY docs.modified, docs.id"
+)
+
+genres_by_id_query = genres_select_query + """
+WHERE g.id = ANY(%(ids)s::uuid[]);
+"""
+
+persons_by_id_filter = """
+WHERE p.id = ANY(%(ids)s::uuid[])
+GROUP BY p.id;
+"""
+
+persons_films_by_id_query = persons_films_select_query + persons_by_id_filter
+
+genres_documents_by_id_query = as_document_query(genres_by_id_query)
+
+persons_documents_by_id_query = (
+    persons_documents_select_query + persons_by_id_filter
+)
+
+# Шардированная первичная загрузка: id объектов из диапазона
+# [lower_id, upper_id] по порядку, документы собираются enrich_query
+shard_ids_query = """
+SELECT t.id
+FROM content.{table} t
+WHERE t.id BETWEEN %(lower_id)s::uuid AND %(upper_id)s::uuid
+ORDER BY t.id
+LIMIT %(limit)s;
+"""
+
+films_shard_query = shard_ids_query.format(table="film_work")
+
+genres_shard_query = shard_ids_query.format(table="genre")
+
+persons_shard_query = shard_ids_query.format(table="person")
+
+snapshot_time_query = "SELECT NOW() AS modified;"
+
+# Режим LISTEN/NOTIFY: триггеры таблиц content.* отправляют в канал
+# json вида {"table": "person_film_work", "film_work_id": ..., ...}
+# с перечисленными для таблицы столбцами изменённой строки
+notify_tables = {
+    "film_work": ("id",),
+    "person": ("id",),
+    "genre": ("id",),
+    "person_film_work": ("film_work_id", "person_id"),
+    "genre_film_work": ("film_work_id", "genre_id"),
+}
+
+notify_function_query = """
+CREATE OR REPLACE FUNCTION content.etl_notify_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    row_data jsonb;
+    payload jsonb := jsonb_build_object('table', TG_TABLE_NAME);
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_data := to_jsonb(OLD);
+    ELSE
+        row_data := to_jsonb(NEW);
+    END IF;
+    -- TG_ARGV[0] - канал, остальные аргументы - столбцы для ETL
+    FOR i IN 1 .. TG_NARGS - 1 LOOP
+        payload := payload || jsonb_build_object(
+            TG_ARGV[i], row_data -> TG_ARGV[i]
+        );
+    END LOOP;
+    PERFORM pg_notify(TG_ARGV[0], payload::text);
+    RETURN NULL;
+END;
+$$;
+"""
+
+notify_trigger_query = """
+DROP TRIGGER IF EXISTS etl_notify_change ON content.{table};
+CREATE TRIGGER etl_notify_change
+AFTER INSERT OR UPDATE OR DELETE ON content.{table}
+FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change({arguments});
+"""
+
+# Ключ изменения - "таблица.столбец"; запрос переводит id из
+# уведомлений в id документов индекса, None - id совпадают
+films_notify_queries = {
+    "film_work.id": None,
+    "person_film_work.film_work_id": None,
+    "genre_film_work.film_work_id": None,
+    "person.id": """
+SELECT DISTINCT pfw.film_work_id AS id
+FROM content.person_film_work pfw
+WHERE pfw.person_id = ANY(%(ids)s::uuid[]);
+""",
+    "genre.id": """
+SELECT DISTINCT gfw.film_work_id AS id
+FROM content.genre_film_work gfw
+WHERE gfw.genre_id = ANY(%(ids)s::uuid[]);
+""",
+}
+
+genres_notify_queries = {
+    "genre.id": None,
+}
+
+persons_notify_queries = {
+    "person.id": None,
+    "person_film_work.person_id": None,
+    "film_work.id": """
+SELECT DISTINCT pfw.person_id AS id
+FROM content.person_film_work pfw
+WHERE pfw.film_work_id = ANY(%(ids)s::uuid[]);
+""",
+}
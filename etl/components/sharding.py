@@ -0,0 +1,378 @@
+"""
+Шардированная первичная загрузка индекса: пространство uuid делится
+на ETL_SHARDS диапазонов, каждый выгружается отдельным процессом
+со своими соединениями postgres и Elasticsearch. Состояние пишет
+только основной процесс: шарды присылают ему результаты пачек
+и позиции в своих диапазонах, из которых собирается общая
+контрольная точка индекса `{index}_shards`.
+"""
+import asyncio
+import functools
+import multiprocessing
+import queue
+import time
+from collections import deque
+from datetime import datetime
+from multiprocessing.process import BaseProcess
+from typing import Any, NamedTuple
+from uuid import UUID
+
+from psycopg2.extras import RealDictCursor
+
+from clients.elasticsearch_clients import ElasticsearchClient
+from clients.postgres_client import AsyncPostgresClient, PostgresPool
+from components import metrics, queries
+from components.config import AppSettings, fingerprints_file_path
+from components.fingerprints import FingerprintCache
+from components.models import ModelETL
+from components.pipe import Pipe
+from components.storage import MemoryStorage, State
+
+SHARDS_STARTED = "Первичная загрузка индекса {index} в {count} процессах."
+SHARD_FAILED = "Шард {shard} индекса {index} остановлен: {error}."
+SHARD_DIED = "Процесс шарда {shard} индекса {index} завершился с кодом {code}."
+SHARDS_FAILED = "Шарды {shards} индекса {index} не завершены."
+
+REPORT_VALIDATION = "validation"
+REPORT_LOAD = "load"
+REPORT_CURSOR = "cursor"
+REPORT_DONE = "done"
+REPORT_ERROR = "error"
+
+
+class Shard(NamedTuple):
+    number: int
+    # Ещё не выгруженная часть диапазона: [lower, upper]
+    lower: UUID
+    upper: UUID
+
+
+def shard_ranges(count: int) -> list[tuple[UUID, UUID]]:
+    """Равные диапазоны uuid; postgres сравнивает uuid побайтно"""
+    bounds = [(1 << 128) * number // count for number in range(count + 1)]
+    return [
+        (UUID(int=bounds[number]), UUID(int=bounds[number + 1] - 1))
+        for number in range(count)
+    ]
+
+
+class ShardTracker:
+    """Результаты пачек шарда уходят в основной процесс"""
+
+    def __init__(self, reports: multiprocessing.Queue):
+        self._reports = reports
+
+    def record_validation(
+        self, success_ids: set, errors: dict, payloads: dict | None = None
+    ) -> None:
+        self._reports.put((REPORT_VALIDATION, success_ids, errors, payloads))
+
+    def record_load(
+        self, success_ids: set, errors: dict, payloads: dict | None = None
+    ) -> None:
+        self._reports.put((REPORT_LOAD, success_ids, errors, payloads))
+
+
+class ShardPipe(Pipe):
+    """
+    Выгрузка одного диапазона id страницами по batch_size.
+    После подтверждения пачки основной процесс получает начало
+    ещё не выгруженной части диапазона.
+    """
+
+    def __init__(
+        self,
+        *args,
+        shard: Shard,
+        reports: multiprocessing.Queue,
+        **kwargs,
+    ):
+        self.shard = shard
+        self.reports = reports
+        super().__init__(*args, **kwargs)
+        # Позиции диапазона после каждой пачки в очереди
+        self._cursors: deque[str | None] = deque()
+
+    def create_tracker(self) -> ShardTracker:
+        """Ошибки и счётчики индекса ведёт основной процесс"""
+        return ShardTracker(self.reports)
+
+    async def extract(self) -> None:
+        lower = self.shard.lower
+        async with self._pg_pool.connection() as pg_conn:
+            while lower is not None:
+                lower = await self.extract_page(pg_conn, lower)
+        await self._Queue.put(None)
+
+    async def extract_page(
+        self, pg_conn: AsyncPostgresClient, lower: UUID
+    ) -> UUID | None:
+        """Одна страница диапазона, возвращает начало следующей"""
+        batch_size = self.batch_size
+        async with pg_conn.cursor() as cur:
+            await cur.execute(
+                self.model_params.shard_query,
+                {
+                    "lower_id": str(lower),
+                    "upper_id": str(self.shard.upper),
+                    "limit": batch_size,
+                },
+            )
+            ids = [str(row["id"]) for row in await cur.fetchmany(batch_size)]
+        if not ids:
+            return None
+        last = UUID(ids[-1])
+        following = (
+            UUID(int=last.int + 1)
+            if len(ids) == batch_size and last < self.shard.upper
+            else None
+        )
+        data = await self.fetch_by_ids(pg_conn, ids)
+        if data:
+            self._cursors.append(following and str(following))
+            await self.put_batch(data)
+        return following
+
+    def batch_bounds(self, rows) -> tuple[None, None]:
+        """Строки идут по id, метку ставит основной процесс"""
+        return None, None
+
+    async def acknowledge(self, batch, task) -> datetime | None:
+        last_modified = await super().acknowledge(batch, task)
+        self.reports.put(
+            (REPORT_CURSOR, self.shard.number, self._cursors.popleft())
+        )
+        return last_modified
+
+
+def run_shard(
+    settings: AppSettings,
+    model_params: ModelETL,
+    target_index: str,
+    shard: Shard,
+    reports: multiprocessing.Queue,
+) -> None:
+    """Точка входа процесса шарда"""
+    try:
+        asyncio.run(
+            load_shard(settings, model_params, target_index, shard, reports)
+        )
+    except BaseException as error:
+        settings.logger.exception(
+            SHARD_FAILED.format(
+                shard=shard.number, index=target_index, error=error
+            )
+        )
+        reports.put((REPORT_ERROR, shard.number, str(error)))
+    else:
+        reports.put((REPORT_DONE, shard.number, None))
+
+
+async def load_shard(
+    settings: AppSettings,
+    model_params: ModelETL,
+    target_index: str,
+    shard: Shard,
+    reports: multiprocessing.Queue,
+) -> None:
+    # ETL импортирует этот модуль
+    from components.etl import ETL, create_breaker
+
+    # Подключение с backoff и ping выполняется в потоке, не блокируя
+    # event loop, и до открытия остальных ресурсов шарда
+    elastic_conn = await asyncio.get_running_loop().run_in_executor(
+        None,
+        functools.partial(
+            ElasticsearchClient,
+            dsn=settings.es_settings.elastic_dsn,
+            breaker=create_breaker(settings),
+        ),
+    )
+    pg_settings = settings.pg_settings
+    etl_settings = settings.etl_settings
+    pg_pool = PostgresPool(
+        dsn=pg_settings.pg_dsn,
+        size=1,
+        cursor_factory=RealDictCursor,
+        keepalives=1,
+        keepalives_idle=pg_settings.keepalives_idle,
+    )
+    fingerprints = (
+        FingerprintCache(
+            fingerprints_file_path, etl_settings.fingerprints_memory_size
+        )
+        if etl_settings.fingerprints
+        else None
+    )
+    etl = ETL(
+        elastic_conn=elastic_conn,
+        pg_pool=pg_pool,
+        settings=settings,
+        fingerprints=fingerprints,
+    )
+    try:
+        await ShardPipe(
+            elastic_conn=etl.async_elastic_conn,
+            model_params=model_params,
+            pg_pool=pg_pool,
+            settings=settings,
+            target_index=target_index,
+            fingerprints=fingerprints,
+            shard=shard,
+            reports=reports,
+        ).run()
+    finally:
+        await etl.close()
+        etl.elastic_conn.close()
+        pg_pool.close()
+        if fingerprints:
+            fingerprints.close()
+
+
+class ShardedPipe(Pipe):
+    """
+    Первичная загрузка индекса процессами-шардами. Контрольная точка
+    `{index}_shards` хранит число шардов, метку начала загрузки
+    и позицию каждого шарда; прерванная загрузка продолжается
+    с этих позиций. Метка индекса ставится, когда завершены все шарды:
+    изменения, сделанные во время загрузки, заберёт следующий проход.
+    Процессы создаются через fork и наследуют настройки.
+    """
+
+    def __init__(self, *args, shards: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shards = shards
+        self.shards_key = f"{self.target_index}_shards"
+
+    async def run(self) -> None:
+        start = time.monotonic()
+        checkpoint = await self.get_checkpoint()
+        # Файл состояния принадлежит основному процессу, шарды
+        # получают копию состояния в памяти
+        shard_settings = self.settings.copy(
+            update={"storage": State(MemoryStorage(self.settings.storage.state))}
+        )
+        context = multiprocessing.get_context("fork")
+        reports = context.Queue()
+        processes: dict[int, BaseProcess] = {}
+        for number, (lower, upper) in enumerate(shard_ranges(self.shards)):
+            cursor = checkpoint["cursors"][str(number)]
+            if cursor is None:
+                continue
+            processes[number] = context.Process(
+                target=run_shard,
+                args=(
+                    shard_settings,
+                    self.model_params,
+                    self.target_index,
+                    Shard(number, UUID(cursor), upper),
+                    reports,
+                ),
+                name=f"etl-{self.target_index}-shard-{number}",
+                daemon=True,
+            )
+        self.settings.logger.info(
+            SHARDS_STARTED.format(index=self.target_index, count=len(processes))
+        )
+        try:
+            for process in processes.values():
+                process.start()
+            failed = await self.collect_reports(reports, processes, checkpoint)
+        finally:
+            for process in processes.values():
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+            reports.close()
+        if failed:
+            raise RuntimeError(
+                SHARDS_FAILED.format(
+                    shards=sorted(failed), index=self.target_index
+                )
+            )
+        self.set_watermark(datetime.fromisoformat(checkpoint["watermark"]))
+        self.settings.storage.delete_state(self.shards_key)
+        if self._loaded:
+            metrics.RUN_THROUGHPUT.labels(**self._labels).set(
+                self._loaded / (time.monotonic() - start)
+            )
+
+    async def get_checkpoint(self) -> dict[str, Any]:
+        checkpoint = self.settings.storage.get_state(self.shards_key)
+        if checkpoint and checkpoint["shards"] == self.shards:
+            return checkpoint
+        async with self._pg_pool.connection() as pg_conn:
+            async with pg_conn.cursor() as cur:
+                await cur.execute(queries.snapshot_time_query, ())
+                (row,) = await cur.fetchmany(1)
+        checkpoint = {
+            "shards": self.shards,
+            "watermark": row["modified"].isoformat(),
+            "cursors": {
+                str(number): str(lower)
+                for number, (lower, _) in enumerate(shard_ranges(self.shards))
+            },
+        }
+        self.settings.storage.set_state(self.shards_key, checkpoint, sync=True)
+        return checkpoint
+
+    async def collect_reports(
+        self,
+        reports: multiprocessing.Queue,
+        processes: dict[int, BaseProcess],
+        checkpoint: dict[str, Any],
+    ) -> set[int]:
+        """Разбор сообщений шардов до завершения всех процессов"""
+        loop = asyncio.get_running_loop()
+        running, failed = set(processes), set()
+        while running:
+            try:
+                kind, *payload = await loop.run_in_executor(
+                    None, reports.get, True, 1.0
+                )
+            except queue.Empty:
+                for number in list(running):
+                    process = processes[number]
+                    if process.exitcode is not None:
+                        # Процесс убит, не успев отчитаться
+                        self.settings.logger.error(
+                            SHARD_DIED.format(
+                                shard=number,
+                                index=self.target_index,
+                                code=process.exitcode,
+                            )
+                        )
+                        running.discard(number)
+                        failed.add(number)
+                continue
+            if kind == REPORT_VALIDATION:
+                success_ids, errors, rows = payload
+                self.tracker.record_validation(success_ids, errors, rows)
+                metrics.VALIDATION_ERRORS.labels(**self._labels).inc(
+                    len(errors)
+                )
+            elif kind == REPORT_LOAD:
+                success_ids, errors, documents = payload
+                self.tracker.record_load(success_ids, errors, documents)
+                self._loaded += len(success_ids)
+                metrics.DOCUMENTS_LOADED.labels(**self._labels).inc(
+                    len(success_ids)
+                )
+                metrics.BULK_ERRORS.labels(**self._labels).inc(len(errors))
+            elif kind == REPORT_CURSOR:
+                number, cursor = payload
+                checkpoint["cursors"][str(number)] = cursor
+                self.settings.storage.set_state(
+                    self.shards_key, checkpoint, sync=True
+                )
+            else:
+                number, _ = payload
+                running.discard(number)
+                if kind == REPORT_ERROR:
+                    failed.add(number)
+                    continue
+                checkpoint["cursors"][str(number)] = None
+                self.settings.storage.set_state(
+                    self.shards_key, checkpoint, sync=True
+                )
+        return failed
@@ -1,5 +1,10 @@
 import abc
+import atexit
+import copy
 import json
+import os
+import threading
+import time
 from json import JSONDecodeError
 from pathlib import Path
 from typing import Any, Dict, Union
@@ -8,6 +13,22 @@ from components.logger import logger
 
 FILE_NOT_FOUND = "Файл {name} не найден. Произошла ошибка: {error}."
 READ_ERROR = "Файл {name} не может быть прочитан. Произошла ошибка: {error}."
+JOURNAL_BROKEN_RECORD = (
+    "Журнал {name}: пропущена повреждённая запись в строке {line}."
+)
+JOURNAL_COMPACTED = "Журнал {name} сжат в снимок {snapshot} за {duration} сек."
+
+
+def fsync_directory(path: Path) -> None:
+    """
+    fsync каталога: без него переименование или удаление файла
+    может не пережить отключение питания
+    """
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
 
 
 class BaseStorage:
@@ -21,6 +42,21 @@ class BaseStorage:
         """Достать состояние из хранилища"""
         pass
 
+    def update_state(
+        self, key: str, value: Any, state: Dict, sync: bool = False
+    ) -> None:
+        """Сохранить изменение одного ключа.
+        По умолчанию хранилище перезаписывается целиком."""
+        self.save_state(state)
+
+    def remove_state(self, key: str, state: Dict) -> None:
+        """Удалить ключ из хранилища"""
+        self.save_state(state)
+
+    def close(self) -> None:
+        """Сбросить незаписанные изменения и освободить ресурсы"""
+        pass
+
 
 class JsonFileStorage(BaseStorage):
     def __init__(self, file_path: Union[str, Path] = None):
@@ -45,18 +81,256 @@ class JsonFileStorage(BaseStorage):
         return state
 
 
+class MemoryStorage(BaseStorage):
+    """Состояние только в памяти процесса, начальное - копия state"""
+
+    def __init__(self, state: Dict | None = None):
+        self._state = dict(state or {})
+
+    def save_state(self, state: Dict) -> None:
+        self._state = dict(state)
+
+    def retrieve_state(self) -> Dict:
+        return dict(self._state)
+
+
+class JournalFileStorage(BaseStorage):
+    """
+    Состояние в памяти с журналом изменений (write-ahead log).
+    Каждый set_state дописывает одну строку в `<file>.journal`,
+    снимок `<file>` пересобирается фоновым потоком, когда журнал
+    превышает compact_threshold байт. Формат снимка совместим
+    с JsonFileStorage.
+    :param file_path: путь к снимку состояния
+    :param fsync_interval: период fsync журнала в секундах,
+        0 - fsync после каждой записи
+    :param compact_threshold: размер журнала в байтах для сжатия в снимок
+    """
+
+    def __init__(
+        self,
+        file_path: Union[str, Path],
+        fsync_interval: float = 1.0,
+        compact_threshold: int = 1024 * 1024,
+    ):
+        self._file_path = Path(file_path)
+        self._journal_path = self._file_path.with_name(
+            f"{self._file_path.name}.journal"
+        )
+        self._fsync_interval = fsync_interval
+        self._compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        # Снимок и журнал пересобирает один поток за раз; set_state
+        # берёт только _lock и не ждёт записи снимка. Порядок
+        # захвата: _snapshot_lock, затем _lock
+        self._snapshot_lock = threading.Lock()
+        # Значения хранятся уже сериализованными: снимок собирается
+        # без повторного json.dumps и не видит мутаций после set_state
+        self._records: dict[str, str] = self._load()
+        self._journal = open(self._journal_path, "ab")
+        self._unsynced = False
+        self._last_sync = time.monotonic()
+        if self._journal.tell():
+            # Журнал после прошлого запуска: переносим в снимок,
+            # заодно отрезая оборванную при падении запись
+            self.compact()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(
+            target=self._background, name="state-journal", daemon=True
+        )
+        self._worker.start()
+        atexit.register(self.close)
+
+    def save_state(self, state: Dict) -> None:
+        with self._snapshot_lock, self._lock:
+            self._records = {
+                key: self._dumps(value) for key, value in state.items()
+            }
+            self._write_snapshot(self._records)
+            self._reset_journal(b"")
+
+    def retrieve_state(self) -> Dict:
+        with self._lock:
+            return {
+                key: json.loads(value) for key, value in self._records.items()
+            }
+
+    def update_state(
+        self, key: str, value: Any, state: Dict, sync: bool = False
+    ) -> None:
+        encoded = self._dumps(value)
+        record = f'{{"key": {self._dumps(key)}, "value": {encoded}}}\n'
+        with self._lock:
+            self._records[key] = encoded
+            self._append(record, sync)
+
+    def remove_state(self, key: str, state: Dict) -> None:
+        record = f'{{"key": {self._dumps(key)}, "deleted": true}}\n'
+        with self._lock:
+            self._records.pop(key, None)
+            self._append(record)
+
+    def flush(self) -> None:
+        """Принудительный fsync журнала"""
+        with self._lock:
+            self._sync()
+
+    def compact(self) -> None:
+        """
+        Записать снимок и оставить в журнале только новые записи.
+        Снимок пишется без _lock: set_state в это время дописывает
+        журнал, а save_state ждёт _snapshot_lock.
+        """
+        start = time.time()
+        with self._snapshot_lock:
+            with self._lock:
+                records = dict(self._records)
+                self._journal.flush()
+                offset = self._journal.tell()
+            self._write_snapshot(records)
+            with self._lock:
+                self._journal.flush()
+                with open(self._journal_path, "rb") as read_file:
+                    read_file.seek(offset)
+                    tail = read_file.read()
+                self._reset_journal(tail)
+        logger.debug(
+            JOURNAL_COMPACTED.format(
+                name=self._journal_path,
+                snapshot=self._file_path,
+                duration=round(time.time() - start, 2),
+            )
+        )
+
+    def close(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._worker.join()
+        self.compact()
+        with self._lock:
+            self._journal.close()
+
+    @staticmethod
+    def _dumps(value: Any) -> str:
+        return json.dumps(value, ensure_ascii=False, default=str)
+
+    def _load(self) -> dict[str, str]:
+        state = JsonFileStorage(self._file_path).retrieve_state()
+        records = {key: self._dumps(value) for key, value in state.items()}
+        try:
+            with open(self._journal_path, "r", encoding="utf-8") as journal:
+                for line_number, line in enumerate(journal, start=1):
+                    try:
+                        record = json.loads(line)
+                        if record.get("deleted"):
+                            records.pop(record["key"], None)
+                            continue
+                        records[record["key"]] = self._dumps(record["value"])
+                    except (JSONDecodeError, KeyError, TypeError):
+                        # Оборванная при падении последняя строка
+                        logger.warning(
+                            JOURNAL_BROKEN_RECORD.format(
+                                name=self._journal_path, line=line_number
+                            )
+                        )
+        except FileNotFoundError as error:
+            logger.debug(
+                FILE_NOT_FOUND.format(name=self._journal_path, error=error)
+            )
+        return records
+
+    def _append(self, record: str, sync: bool = False) -> None:
+        """Дописать строку журнала; вызывается под _lock"""
+        self._journal.write(record.encode("utf-8"))
+        self._journal.flush()
+        if sync or self._fsync_interval <= 0:
+            self._sync()
+        else:
+            self._unsynced = True
+
+    def _sync(self) -> None:
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._unsynced = False
+        self._last_sync = time.monotonic()
+
+    def _write_snapshot(self, records: dict[str, str]) -> None:
+        body = ", ".join(
+            f"{self._dumps(key)}: {value}" for key, value in records.items()
+        )
+        tmp_path = self._file_path.with_name(f"{self._file_path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as write_file:
+            write_file.write(f"{{{body}}}")
+            write_file.flush()
+            os.fsync(write_file.fileno())
+        os.replace(tmp_path, self._file_path)
+        # Снимок должен оказаться на диске до сброса журнала
+        fsync_directory(self._file_path.parent)
+
+    def _reset_journal(self, tail: bytes) -> None:
+        tmp_path = self._journal_path.with_name(
+            f"{self._journal_path.name}.tmp"
+        )
+        with open(tmp_path, "wb") as write_file:
+            write_file.write(tail)
+            write_file.flush()
+            os.fsync(write_file.fileno())
+        self._journal.close()
+        os.replace(tmp_path, self._journal_path)
+        fsync_directory(self._journal_path.parent)
+        self._journal = open(self._journal_path, "ab")
+
+    def _background(self) -> None:
+        tick = min(self._fsync_interval, 1.0) if self._fsync_interval else 1.0
+        while not self._stop.wait(tick):
+            try:
+                with self._lock:
+                    if (
+                        self._unsynced
+                        and time.monotonic() - self._last_sync
+                        >= self._fsync_interval
+                    ):
+                        self._sync()
+                    oversized = (
+                        self._journal.tell() >= self._compact_threshold
+                    )
+                if oversized:
+                    self.compact()
+            except OSError as error:
+                logger.exception(
+                    READ_ERROR.format(name=self._journal_path, error=error)
+                )
+
+
 class State:
     def __init__(self, _storage: BaseStorage):
         self._storage = _storage
-        self._state: dict[str, Any] = {}
+        self._state: dict[str, Any] | None = None
+
+    @property
+    def state(self) -> dict[str, Any]:
+        """Состояние читается из хранилища один раз и живёт в памяти"""
+        if self._state is None:
+            self._state = self._storage.retrieve_state()
+        return self._state
 
-    def set_state(self, key: str, value: Any) -> None:
-        """Установить состояние для ключа"""
-        if self._state is not None:
-            self._state[key] = value
-            self._storage.save_state(self._state)
+    def set_state(self, key: str, value: Any, sync: bool = False) -> None:
+        """Установить состояние для ключа.
+        sync=True - дождаться записи на диск (для подтверждённых меток).
+        Хранится копия: изменения value после вызова не попадают
+        в состояние мимо журнала"""
+        self.state[key] = copy.deepcopy(value)
+        self._storage.update_state(key, value, self.state, sync=sync)
 
     def get_state(self, key: str) -> Any:
-        """Достать состояние ключа"""
-        self._state = self._storage.retrieve_state()
-        return self._state.get(key)
+        """Копия состояния ключа, изменения сохраняет только set_state"""
+        return copy.deepcopy(self.state.get(key))
+
+    def delete_state(self, key: str) -> None:
+        """Удалить ключ из состояния"""
+        if self.state.pop(key, None) is not None:
+            self._storage.remove_state(key, self.state)
+
+    def close(self) -> None:
+        self._storage.close()
@@ -0,0 +1,182 @@
+"""
+Запуск каждой модели ETL в отдельном процессе: преобразование
+большого индекса не занимает GIL и event loop маленьких, а падение
+одного процесса не останавливает остальные.
+"""
+import argparse
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from pathlib import Path
+from typing import Any, Callable
+
+from components.config import AppSettings, storage_file_path
+from components.models import ModelETL
+from components.storage import JsonFileStorage, State
+
+WORKER_STARTED = "Процесс {name} индекса {index} запущен, pid {pid}."
+WORKER_DIED = (
+    "Процесс {name} индекса {index} завершился с кодом {code}, "
+    "перезапуск через {delay} сек."
+)
+SUPERVISOR_STOPPED = "Супервизор остановлен, процессы индексов завершены."
+
+WorkerTarget = Callable[[AppSettings, argparse.Namespace], None]
+
+
+def worker_state_path(index_name: str) -> Path:
+    """Файл состояния процесса индекса"""
+    return storage_file_path.with_name(f"state_{index_name}.json")
+
+
+def run_worker(
+    settings: AppSettings,
+    model_params: ModelETL,
+    number: int,
+    state: dict[str, Any],
+    target: WorkerTarget,
+    args: argparse.Namespace,
+) -> None:
+    """
+    Точка входа процесса индекса: своё состояние, свои соединения
+    и единственная модель в настройках.
+    :param state: состояние общего файла для первого запуска
+    """
+    state_path = worker_state_path(model_params.index_name)
+    journal_path = state_path.with_name(f"{state_path.name}.journal")
+    if not state_path.exists() and not journal_path.exists():
+        # Метки и реестры индекса переносятся из общего файла
+        JsonFileStorage(state_path).save_state(state)
+    etl_settings = settings.etl_settings
+    settings = settings.copy(
+        update={
+            "etl_models": [model_params],
+            "storage": State(
+                settings.state_settings.get_storage(state_path)
+            ),
+            "etl_settings": etl_settings.copy(
+                update={
+                    # Триггеры общие, их ставит первый процесс
+                    "install_triggers": etl_settings.install_triggers
+                    and number == 0,
+                    "metrics_port": etl_settings.metrics_port
+                    and etl_settings.metrics_port + number,
+                }
+            ),
+        }
+    )
+    try:
+        target(settings, args)
+    finally:
+        settings.storage.close()
+
+
+class Supervisor:
+    """
+    Процесс на каждую модель из settings.etl_models. Упавший процесс
+    перезапускается через restart_delay секунд, остальные продолжают
+    работу. Процессы создаются через fork и наследуют настройки.
+    :param settings: настройки приложения
+    :param target: цикл ETL процесса индекса
+    :param args: аргументы командной строки
+    """
+
+    def __init__(
+        self,
+        settings: AppSettings,
+        target: WorkerTarget,
+        args: argparse.Namespace,
+    ):
+        self.settings = settings
+        self.target = target
+        self.args = args
+        self._context = multiprocessing.get_context("fork")
+        self._processes: dict[int, BaseProcess] = {}
+        # Номер процесса -> время перезапуска
+        self._restarts: dict[int, float] = {}
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._terminate)
+        try:
+            for number in range(len(self.settings.etl_models)):
+                self.start(number, self.args)
+            # Переиндексация выполняется только при первом запуске
+            self.args = argparse.Namespace(
+                **{**vars(self.args), "full_reindex": None}
+            )
+            while True:
+                self.watch()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            self.stop()
+
+    def start(self, number: int, args: argparse.Namespace) -> None:
+        model_params = self.settings.etl_models[number]
+        process = self._context.Process(
+            target=run_worker,
+            args=(
+                self.settings,
+                model_params,
+                number,
+                self.settings.storage.state,
+                self.target,
+                args,
+            ),
+            name=f"etl-{model_params.index_name}",
+        )
+        process.start()
+        self._processes[number] = process
+        self.settings.logger.info(
+            WORKER_STARTED.format(
+                name=process.name,
+                index=model_params.index_name,
+                pid=process.pid,
+            )
+        )
+
+    def watch(self) -> None:
+        """Ожидание завершения процессов и перезапуск упавших"""
+        now = time.monotonic()
+        for number, restart_at in list(self._restarts.items()):
+            if restart_at <= now:
+                del self._restarts[number]
+                self.start(number, self.args)
+        timeout = (
+            max(min(self._restarts.values()) - now, 0)
+            if self._restarts
+            else None
+        )
+        running = {
+            process.sentinel: number
+            for number, process in self._processes.items()
+            if number not in self._restarts
+        }
+        for sentinel in wait(list(running), timeout):
+            number = running[sentinel]
+            process = self._processes[number]
+            process.join()
+            delay = self.settings.etl_settings.restart_delay
+            self.settings.logger.error(
+                WORKER_DIED.format(
+                    name=process.name,
+                    index=self.settings.etl_models[number].index_name,
+                    code=process.exitcode,
+                    delay=delay,
+                )
+            )
+            self._restarts[number] = time.monotonic() + delay
+
+    def stop(self) -> None:
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes.values():
+            process.join()
+        self.settings.logger.info(SUPERVISOR_STOPPED)
+
+    @staticmethod
+    def _terminate(signum, frame) -> None:
+        raise SystemExit(signum)
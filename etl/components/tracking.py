@@ -0,0 +1,147 @@
+from typing import Any, Iterable, Iterator, NamedTuple
+from uuid import UUID
+
+from components.deadletter import DeadLetterStore
+from components.storage import State
+
+STAGE_VALIDATION = "pgsql"
+STAGE_LOAD = "elastic"
+LEGACY_STAGES = (STAGE_VALIDATION, STAGE_LOAD)
+
+
+class ErrorRecord(NamedTuple):
+    id: UUID
+    stage: str
+    error: str
+    timestamp: float
+
+
+class IndexTracker:
+    """
+    Учёт результатов индекса: счётчики в состоянии и dead-letter
+    файлы ошибок. Успешные id не хранятся; ошибка документа
+    снимается, когда он проходит тот же этап.
+    :param index_name: имя индекса
+    :param storage: хранилище состояния
+    :param dead_letters: dead-letter файлы индекса
+    """
+
+    counter_names = (
+        "validated",
+        "validation_errors",
+        "loaded",
+        "load_errors",
+    )
+
+    def __init__(
+        self,
+        index_name: str,
+        storage: State,
+        dead_letters: DeadLetterStore,
+    ):
+        self.index_name = index_name
+        self.dead_letters = dead_letters
+        self._storage = storage
+        self._stats_key = f"{index_name}_stats"
+        self.counters: dict[str, int] = dict.fromkeys(self.counter_names, 0)
+        self.counters.update(storage.get_state(self._stats_key) or {})
+        self._migrate_legacy_state()
+
+    def record_validation(
+        self,
+        success_ids: set,
+        errors: dict,
+        payloads: dict[Any, Any] | None = None,
+    ) -> None:
+        """Учесть результат валидации пачки"""
+        self._record(STAGE_VALIDATION, success_ids, errors, payloads)
+        self.counters["validated"] += len(success_ids)
+        self.counters["validation_errors"] += len(errors)
+        self.save()
+
+    def record_load(
+        self,
+        success_ids: set,
+        errors: dict,
+        payloads: dict[Any, Any] | None = None,
+    ) -> None:
+        """Учесть результат загрузки пачки в Elasticsearch"""
+        self._record(STAGE_LOAD, success_ids, errors, payloads)
+        self.counters["loaded"] += len(success_ids)
+        self.counters["load_errors"] += len(errors)
+        self.save()
+
+    def get_error(self, doc_id: UUID | str) -> ErrorRecord | None:
+        """Последняя ошибка документа, если она ещё хранится"""
+        letter = self.dead_letters.get(doc_id)
+        if letter is None:
+            return None
+        return ErrorRecord(UUID(letter.id), *letter[1:])
+
+    def errors(self, stage: str | None = None) -> Iterator[ErrorRecord]:
+        """Ошибки от старых к новым, опционально только одного этапа"""
+        for letter in self.dead_letters.pending(stage):
+            yield ErrorRecord(UUID(letter.id), *letter[1:])
+
+    def __len__(self) -> int:
+        return len(self.dead_letters)
+
+    def __contains__(self, doc_id: UUID | str) -> bool:
+        return doc_id in self.dead_letters
+
+    def save(self) -> None:
+        """Ошибки пишутся в dead-letter файлы, в состоянии - счётчики"""
+        self._storage.set_state(self._stats_key, self.counters)
+
+    def _record(
+        self,
+        stage: str,
+        success_ids: Iterable,
+        errors: dict,
+        payloads: dict[Any, Any] | None,
+    ) -> None:
+        self.dead_letters.resolve(success_ids, stage)
+        self.dead_letters.add(stage, errors, payloads)
+
+    def _migrate_legacy_state(self) -> None:
+        """
+        Перенос ошибок из state.json: реестра `{index}_errors`
+        и списков `{index}_{stage}_success/_errors`
+        """
+        errors_key = f"{self.index_name}_errors"
+        legacy_keys = [errors_key] + [
+            f"{self.index_name}_{stage}_{kind}"
+            for stage in LEGACY_STAGES
+            for kind in ("success", "errors")
+        ]
+        if all(self._storage.get_state(key) is None for key in legacy_keys):
+            return
+        registry = self._storage.get_state(errors_key) or {}
+        for stage in LEGACY_STAGES:
+            self.dead_letters.add(
+                stage,
+                {
+                    str(UUID(hex=doc_id)): error
+                    for doc_id, (error_stage, error, _) in registry.items()
+                    if error_stage == stage
+                },
+            )
+        errors = self._storage.get_state(
+            f"{self.index_name}_{STAGE_VALIDATION}_errors"
+        )
+        self.dead_letters.add(STAGE_VALIDATION, errors or {})
+        self.dead_letters.add(
+            STAGE_LOAD,
+            {
+                doc_id: ""
+                for doc_id in (
+                    self._storage.get_state(
+                        f"{self.index_name}_{STAGE_LOAD}_errors"
+                    )
+                    or []
+                )
+                if isinstance(doc_id, str)
+            },
+        )
+        for key in legacy_keys:
+            self._storage.delete_state(key)
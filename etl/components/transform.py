@@ -0,0 +1,53 @@
+"""
+Преобразование строк postgres в документы Elasticsearch.
+Модуль не зависит от настроек приложения: функции выполняются
+в процессах ProcessPoolExecutor, куда строки передаются
+компактными кортежами вместо RealDictRow.
+"""
+from typing import Any, Iterable, Mapping, NamedTuple
+
+from psycopg2.extras import RealDictRow
+from pydantic import BaseModel
+from pydantic.error_wrappers import ValidationError
+
+
+class CompactRows(NamedTuple):
+    columns: tuple[str, ...]
+    values: list[tuple[Any, ...]]
+
+
+class TransformResult(NamedTuple):
+    # Пары (id, документ) в порядке строк пачки
+    documents: list[tuple[str, dict]]
+    errors: dict[Any, str]
+    success_ids: set
+
+
+def compact_rows(rows: Iterable[RealDictRow]) -> CompactRows:
+    """Имена столбцов передаются один раз на пачку"""
+    rows = list(rows)
+    columns = tuple(rows[0].keys()) if rows else ()
+    return CompactRows(columns, [tuple(row.values()) for row in rows])
+
+
+def validate_rows(
+    model: type[BaseModel], rows: Iterable[Mapping]
+) -> TransformResult:
+    """Валидация строк моделью, ошибки собираются по id строки"""
+    documents, errors, success_ids = [], {}, set()
+    for row in rows:
+        try:
+            documents.append((str(row["id"]), model(**row).dict()))
+            success_ids.add(row["id"])
+        except ValidationError as err:
+            errors[row["id"]] = str(err)
+    return TransformResult(documents, errors, success_ids)
+
+
+def transform_rows(
+    model: type[BaseModel], rows: CompactRows
+) -> TransformResult:
+    """Точка входа процесса-обработчика"""
+    return validate_rows(
+        model, (dict(zip(rows.columns, values)) for values in rows.values)
+    )
@@ -1,45 +1,243 @@
+import argparse
 import asyncio
-from contextlib import closing
-from time import sleep
+import functools
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import AsyncExitStack, closing
 
 import uvloop
 from psycopg2.extras import RealDictCursor
 
 from clients.elasticsearch_clients import ElasticsearchClient
-from clients.postgres_client import PostgresClient
-from components.config import AppSettings
-from components.etl import ETL
+from clients.postgres_client import PostgresListener, PostgresPool
+from components.config import (
+    AppSettings,
+    dead_letters_path,
+    fingerprints_file_path,
+)
+from components.deadletter import DeadLetters
+from components.etl import ETL, create_breaker
+from components.fingerprints import FingerprintCache
+from components.metrics import start_metrics_server
+from components.notify import collect_changes
+from components.supervisor import Supervisor
 
 ERROR_MESSAGE = "ETL процесс остановлен. Произошла ошибка: {error}."
 
 
-async def main(settings: AppSettings) -> None:
-    while True:
-        try:
-            with closing(
-                PostgresClient(
-                    dsn=settings.pg_settings.pg_dsn,
-                    cursor_factory=RealDictCursor,
-                )
-            ) as pg_conn, closing(
-                ElasticsearchClient(dsn=settings.es_settings.elastic_dsn)
-            ) as elastic_conn:
-                etl = ETL(
-                    elastic_conn=elastic_conn,
-                    pg_conn=pg_conn,
-                    settings=settings,
-                )
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ETL Postgres -> Elasticsearch")
+    parser.add_argument(
+        "--full-reindex",
+        nargs="*",
+        metavar="INDEX",
+        help=(
+            "перед запуском переиндексировать указанные индексы "
+            "(без аргументов - все) в новые версии с переключением псевдонима"
+        ),
+    )
+    parser.add_argument(
+        "--retry-dead-letters",
+        nargs="*",
+        metavar="INDEX",
+        help=(
+            "выгрузить заново только документы из dead-letter файлов "
+            "указанных индексов (без аргументов - всех) и завершиться"
+        ),
+    )
+    return parser.parse_args()
+
+
+def create_transform_pool(settings: AppSettings) -> ProcessPoolExecutor | None:
+    """Пул процессов живёт между циклами ETL, чтобы не запускать их заново"""
+    workers = settings.etl_settings.transform_workers
+    return ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+
+
+def create_fingerprints(settings: AppSettings) -> FingerprintCache | None:
+    """Отпечатки в памяти переживают циклы ETL вместе с процессом"""
+    etl_settings = settings.etl_settings
+    if not etl_settings.fingerprints:
+        return None
+    return FingerprintCache(
+        fingerprints_file_path, etl_settings.fingerprints_memory_size
+    )
+
+
+def create_dead_letters(settings: AppSettings) -> DeadLetters:
+    """Dead-letter файлы читаются с диска один раз за процесс"""
+    etl_settings = settings.etl_settings
+    return DeadLetters(
+        directory=dead_letters_path,
+        segment_size=etl_settings.dead_letter_segment_size,
+        max_errors=etl_settings.errors_max_size,
+        retention=etl_settings.errors_retention,
+    )
+
+
+async def listen(etl: ETL, settings: AppSettings) -> None:
+    """
+    Режим LISTEN/NOTIFY: выгружаются только документы из уведомлений,
+    раз в fallback_interval - обычный проход по меткам на случай
+    пропущенных. Срок прохода не сдвигается уведомлениями.
+    Возвращается только с ошибкой соединения.
+    """
+    etl_settings = settings.etl_settings
+    # Подключение с backoff выполняется в потоке, не блокируя event loop
+    listener = await asyncio.get_running_loop().run_in_executor(
+        None,
+        functools.partial(
+            PostgresListener,
+            dsn=settings.pg_settings.pg_dsn,
+            channel=etl_settings.notify_channel,
+        ),
+    )
+    with closing(listener):
+        if etl_settings.install_triggers:
+            await etl.install_notify_triggers()
+        listener.start()
+        # Изменения, сделанные до подписки, забирает проход по меткам
+        await etl.start_pipeline()
+        fallback_at = time.monotonic() + etl_settings.fallback_interval
+        while True:
+            changes = await collect_changes(
+                listener,
+                timeout=max(fallback_at - time.monotonic(), 0),
+                debounce=etl_settings.debounce,
+                max_wait=etl_settings.debounce_max_wait,
+            )
+            if changes is not None:
+                await etl.sync_changes(changes)
+            if time.monotonic() >= fallback_at:
                 await etl.start_pipeline()
-        except KeyboardInterrupt:
-            settings.logger.info("Процесс остановлен")
-            break
-        except Exception as error:
-            settings.logger.exception(ERROR_MESSAGE.format(error=error))
-        finally:
-            settings.logger.info("Остановка процесса на 2 минуты")
-            sleep(settings.sleep_interval)
+                fallback_at = (
+                    time.monotonic() + etl_settings.fallback_interval
+                )
+
+
+async def open_etl(
+    stack: AsyncExitStack,
+    settings: AppSettings,
+    transform_pool: ProcessPoolExecutor | None,
+    fingerprints: FingerprintCache | None = None,
+    dead_letters: DeadLetters | None = None,
+) -> ETL:
+    """Соединения и клиенты ETL закрываются вместе со stack"""
+    pg_settings = settings.pg_settings
+    pg_pool = stack.enter_context(
+        closing(
+            PostgresPool(
+                dsn=pg_settings.pg_dsn,
+                size=pg_settings.pool_size or len(settings.etl_models),
+                cursor_factory=RealDictCursor,
+                keepalives=1,
+                keepalives_idle=pg_settings.keepalives_idle,
+            )
+        )
+    )
+    # Подключение с backoff и ping выполняется в потоке,
+    # не блокируя event loop
+    elastic_conn = await asyncio.get_running_loop().run_in_executor(
+        None,
+        functools.partial(
+            ElasticsearchClient,
+            dsn=settings.es_settings.elastic_dsn,
+            breaker=create_breaker(settings),
+        ),
+    )
+    stack.enter_context(closing(elastic_conn))
+    etl = ETL(
+        elastic_conn=elastic_conn,
+        pg_pool=pg_pool,
+        settings=settings,
+        transform_pool=transform_pool,
+        fingerprints=fingerprints,
+        dead_letters=dead_letters,
+    )
+    stack.push_async_callback(etl.close)
+    return etl
+
+
+async def retry_dead_letters(
+    settings: AppSettings, index_names: list[str] | None
+) -> None:
+    fingerprints = create_fingerprints(settings)
+    try:
+        async with AsyncExitStack() as stack:
+            etl = await open_etl(
+                stack,
+                settings,
+                None,
+                fingerprints,
+                create_dead_letters(settings),
+            )
+            await etl.retry_dead_letters(index_names)
+    finally:
+        if fingerprints:
+            fingerprints.close()
+
+
+async def main(settings: AppSettings, args: argparse.Namespace) -> None:
+    if args.retry_dead_letters is not None:
+        await retry_dead_letters(settings, args.retry_dead_letters or None)
+        return
+    full_reindex = args.full_reindex
+    if settings.etl_settings.metrics_port:
+        start_metrics_server(settings.etl_settings.metrics_port)
+    transform_pool = create_transform_pool(settings)
+    fingerprints = create_fingerprints(settings)
+    dead_letters = create_dead_letters(settings)
+    stack = AsyncExitStack()
+    etl = None
+    try:
+        while True:
+            try:
+                if etl is None:
+                    etl = await open_etl(
+                        stack,
+                        settings,
+                        transform_pool,
+                        fingerprints,
+                        dead_letters,
+                    )
+                if full_reindex is not None:
+                    await etl.full_reindex(full_reindex or None)
+                    full_reindex = None
+                if settings.etl_settings.mode == "listen":
+                    await listen(etl, settings)
+                else:
+                    await etl.start_pipeline()
+                if not settings.etl_settings.daemon:
+                    etl = None
+                    await stack.aclose()
+            except KeyboardInterrupt:
+                settings.logger.info("Процесс остановлен")
+                break
+            except Exception as error:
+                settings.logger.exception(ERROR_MESSAGE.format(error=error))
+                # После ошибки соединения и индексы проверяются заново
+                etl = None
+                await stack.aclose()
+            finally:
+                settings.logger.info("Остановка процесса на 2 минуты")
+                await asyncio.sleep(settings.sleep_interval)
+    finally:
+        await stack.aclose()
+        if transform_pool:
+            transform_pool.shutdown(cancel_futures=True)
+        if fingerprints:
+            fingerprints.close()
+
+
+def run(settings: AppSettings, args: argparse.Namespace) -> None:
+    uvloop.install()
+    asyncio.run(main(settings, args))
+
 
 if __name__ == "__main__":
     settings = AppSettings()
-    uvloop.install()
-    asyncio.run(main(settings))
+    args = parse_args()
+    if settings.etl_settings.supervisor and args.retry_dead_letters is None:
+        Supervisor(settings, target=run, args=args).run()
+    else:
+        run(settings, args)
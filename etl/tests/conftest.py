@@ -0,0 +1,10 @@
+import os
+
+# components.config читает настройки при импорте: обязательные
+# параметры postgres
+os.environ.setdefault("POSTGRES_DB", "movies_database")
+os.environ.setdefault("POSTGRES_USER", "app")
+os.environ.setdefault("POSTGRES_PASSWORD", "password")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ.setdefault("POSTGRES_OPTIONS", "")
@@ -0,0 +1,55 @@
+import pytest
+
+from components.batching import AdaptiveBatchSize
+
+
+def create_sizer(**kwargs):
+    params = dict(
+        initial=100,
+        min_size=10,
+        max_size=1000,
+        target_latency=1.0,
+        target_bytes=1_000_000,
+        smoothing=1.0,
+    )
+    params.update(kwargs)
+    return AdaptiveBatchSize(**params)
+
+
+@pytest.mark.parametrize("initial, expected", [(1, 10), (5000, 1000)])
+def test_initial_size_clamped(initial, expected):
+    assert create_sizer(initial=initial).size == expected
+
+
+def test_grows_towards_latency_target():
+    sizer = create_sizer()
+    # 100 документов за 0.25 сек - в секунду уложатся 400
+    assert sizer.observe(100, 0.25, 10_000) == 400
+
+
+def test_smaller_estimate_wins():
+    sizer = create_sizer()
+    # По длительности - 400, по размеру тела - 200
+    assert sizer.observe(100, 0.25, 500_000) == 200
+
+
+def test_smoothing():
+    sizer = create_sizer(smoothing=0.5)
+    assert sizer.observe(100, 0.25, 10_000) == 250
+
+
+def test_bounded_by_max_size():
+    sizer = create_sizer()
+    assert sizer.observe(100, 0.01, 100) == 1000
+
+
+def test_empty_batch_ignored():
+    sizer = create_sizer()
+    assert sizer.observe(0, 5.0, 0) == 100
+
+
+def test_backoff_halves_down_to_min_size():
+    sizer = create_sizer(initial=30)
+    assert sizer.backoff() == 15
+    assert sizer.backoff() == 10
+    assert sizer.backoff() == 10
@@ -0,0 +1,66 @@
+import orjson
+
+from clients.elasticsearch_clients import ndjson_bulk_chunks
+
+
+def documents(count, size=10):
+    return [
+        (f"id-{number}", {"title": "x" * size}) for number in range(count)
+    ]
+
+
+def parse(body):
+    lines = body.splitlines()
+    return [
+        (orjson.loads(action), orjson.loads(source))
+        for action, source in zip(lines[::2], lines[1::2])
+    ]
+
+
+def test_single_chunk_without_limit():
+    chunks = list(ndjson_bulk_chunks(documents(50)))
+    assert len(chunks) == 1
+    body, count = chunks[0]
+    assert count == 50
+    assert body.endswith(b"\n")
+    actions = parse(body)
+    assert actions[0] == ({"index": {"_id": "id-0"}}, {"title": "x" * 10})
+
+
+def test_chunks_within_max_bytes():
+    docs = documents(100, size=100)
+    max_bytes = 1000
+    chunks = list(ndjson_bulk_chunks(docs, max_bytes))
+    assert len(chunks) > 1
+    for body, count in chunks:
+        assert len(body) <= max_bytes
+        assert len(parse(body)) == count
+    assert sum(count for _, count in chunks) == len(docs)
+    sent = [
+        action["index"]["_id"]
+        for body, _ in chunks
+        for action, _ in parse(body)
+    ]
+    assert sent == [doc_id for doc_id, _ in docs]
+
+
+def test_oversized_document_sent_alone():
+    docs = documents(1) + documents(1, size=5000) + documents(1)
+    chunks = list(ndjson_bulk_chunks(docs, max_bytes=1000))
+    assert [count for _, count in chunks] == [1, 1, 1]
+    assert len(chunks[1][0]) > 1000
+
+
+def test_passthrough_json_text_and_update_action():
+    chunks = list(
+        ndjson_bulk_chunks(
+            [("id-1", '{"doc": {"title": "new"}}')], action_type="update"
+        )
+    )
+    assert parse(chunks[0][0]) == [
+        ({"update": {"_id": "id-1"}}, {"doc": {"title": "new"}})
+    ]
+
+
+def test_no_documents_no_chunks():
+    assert list(ndjson_bulk_chunks([], max_bytes=1000)) == []
@@ -0,0 +1,152 @@
+import os
+import time
+import uuid
+from pathlib import Path
+from unittest import mock
+
+import orjson
+import pytest
+
+from components.deadletter import DeadLetters, DeadLetterStore
+
+INDEX = "movies"
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    def opener(**kwargs):
+        return DeadLetterStore(tmp_path, INDEX, **kwargs)
+
+    return opener
+
+
+def new_ids(count):
+    return [str(uuid.uuid4()) for _ in range(count)]
+
+
+def segment_records(tmp_path):
+    return [
+        orjson.loads(line)
+        for segment in sorted((tmp_path / INDEX).iterdir())
+        for line in segment.read_bytes().splitlines()
+    ]
+
+
+def test_errors_and_payloads_survive_reopen(open_store, tmp_path):
+    doc_id, other_id = new_ids(2)
+    store = open_store()
+    store.add("pgsql", {doc_id: "bad", other_id: "bad"}, {doc_id: {"a": 1}})
+    store.resolve([other_id], "pgsql")
+
+    reopened = open_store()
+    assert [letter.id for letter in reopened.pending()] == [doc_id]
+    assert reopened.get(doc_id).error == "bad"
+    assert other_id not in reopened
+    assert segment_records(tmp_path)[0]["payload"] == {"a": 1}
+
+
+def test_resolve_only_matching_stage(open_store):
+    (doc_id,) = new_ids(1)
+    store = open_store()
+    store.add("elastic", {doc_id: "rejected"})
+    store.resolve([doc_id], "pgsql")
+    assert doc_id in store
+    store.resolve([uuid.UUID(doc_id)], "elastic")
+    assert doc_id not in store
+
+
+def test_max_errors_evicts_oldest_on_add(open_store, tmp_path):
+    ids = new_ids(51)
+    store = open_store(max_errors=3, segment_size=200)
+    for doc_id in ids:
+        store.add("pgsql", {doc_id: "bad"}, {doc_id: {"payload": doc_id}})
+
+    assert [letter.id for letter in store.pending()] == ids[-3:]
+    # Сжатие после каждых segment_size байт держит файлы в пределах
+    assert len(list((tmp_path / INDEX).iterdir())) == 1
+    assert len(segment_records(tmp_path)) <= 4
+    assert [letter.id for letter in open_store(max_errors=3).pending()] == (
+        ids[-3:]
+    )
+
+
+def test_eviction_replayed_on_open(open_store):
+    ids = new_ids(5)
+    store = open_store(max_errors=3)
+    for doc_id in ids:
+        store.add("pgsql", {doc_id: "bad"})
+    store.resolve([ids[-1]])
+
+    # Вытесненные записи остаются в файле до сжатия, но не возвращаются
+    reopened = open_store(max_errors=3)
+    assert [letter.id for letter in reopened.pending()] == ids[2:4]
+
+
+def test_retention_evicts_expired(open_store):
+    old_id, new_id = new_ids(2)
+    store = open_store(retention=0.2)
+    store.add("pgsql", {old_id: "bad"})
+    time.sleep(0.3)
+    store.add("pgsql", {new_id: "bad"})
+
+    assert [letter.id for letter in store.pending()] == [new_id]
+
+
+def test_compact_keeps_latest_pending_records(open_store, tmp_path):
+    doc_id, resolved_id = new_ids(2)
+    store = open_store()
+    store.add("pgsql", {doc_id: "first", resolved_id: "bad"})
+    store.add("elastic", {doc_id: "second"}, {doc_id: {"a": 2}})
+    store.resolve([resolved_id])
+    store.compact()
+
+    records = segment_records(tmp_path)
+    assert [(record["id"], record["error"]) for record in records] == [
+        (doc_id, "second")
+    ]
+    assert records[0]["payload"] == {"a": 2}
+
+
+def test_torn_line_compacted_on_open(open_store, tmp_path):
+    doc_id, torn_id = new_ids(2)
+    store = open_store()
+    store.add("pgsql", {doc_id: "bad"})
+    store.add("pgsql", {torn_id: "bad"})
+    (segment,) = (tmp_path / INDEX).iterdir()
+    segment.write_bytes(segment.read_bytes()[:-10])
+
+    reopened = open_store()
+    assert [letter.id for letter in reopened.pending()] == [doc_id]
+    assert [record["id"] for record in segment_records(tmp_path)] == [doc_id]
+
+
+def test_compact_syncs_new_segment_before_unlink(open_store):
+    (doc_id,) = new_ids(1)
+    store = open_store()
+    store.add("pgsql", {doc_id: "bad"})
+    calls = []
+    unlink = Path.unlink
+
+    def record_unlink(path, *args, **kwargs):
+        calls.append("unlink")
+        unlink(path, *args, **kwargs)
+
+    with mock.patch(
+        "components.deadletter.os.fsync",
+        side_effect=lambda descriptor: calls.append("fsync"),
+    ), mock.patch(
+        "components.deadletter.fsync_directory",
+        side_effect=lambda path: calls.append("directory"),
+    ), mock.patch.object(Path, "unlink", record_unlink):
+        store.compact()
+
+    assert calls.index("unlink") > calls.index("fsync")
+    assert calls.index("unlink") > calls.index("directory")
+    assert os.path.getsize(store._segment) > 0
+
+
+def test_dead_letters_open_store_once(tmp_path):
+    dead_letters = DeadLetters(tmp_path)
+    store = dead_letters.store(INDEX)
+    assert dead_letters.store(INDEX) is store
+    assert dead_letters.store("genres") is not store
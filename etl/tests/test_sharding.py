@@ -0,0 +1,31 @@
+from uuid import UUID
+
+import pytest
+
+from components.sharding import shard_ranges
+
+MAX_UUID = UUID(int=(1 << 128) - 1)
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 4, 7, 16])
+def test_ranges_cover_uuid_space(count):
+    ranges = shard_ranges(count)
+    assert len(ranges) == count
+    assert ranges[0][0] == UUID(int=0)
+    assert ranges[-1][1] == MAX_UUID
+    for (_, upper), (lower, _) in zip(ranges, ranges[1:]):
+        assert lower.int == upper.int + 1
+
+
+@pytest.mark.parametrize("count", [2, 3, 7])
+def test_ranges_nearly_equal(count):
+    sizes = [upper.int - lower.int + 1 for lower, upper in shard_ranges(count)]
+    assert max(sizes) - min(sizes) <= 1
+
+
+def test_ranges_follow_postgres_uuid_order():
+    # postgres сравнивает uuid побайтно, как UUID.bytes
+    bounds = [bound for pair in shard_ranges(4) for bound in pair]
+    assert bounds == sorted(bounds, key=lambda value: value.bytes)
+    middle = UUID("80000000-0000-0000-0000-000000000000")
+    assert shard_ranges(2)[1][0] == middle
@@ -0,0 +1,175 @@
+import json
+import os
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from components.storage import JournalFileStorage, State
+
+
+@pytest.fixture
+def file_path(tmp_path):
+    return tmp_path / "state.json"
+
+
+def open_storage(file_path, **kwargs):
+    kwargs.setdefault("compact_threshold", 1024 * 1024)
+    return JournalFileStorage(file_path, **kwargs)
+
+
+def test_journal_replayed_after_crash(file_path):
+    storage = open_storage(file_path)
+    state = State(storage)
+    state.set_state("movies_modified", "2022-01-01T00:00:00")
+    state.set_state("genres_modified", "2022-01-02T00:00:00")
+    state.delete_state("genres_modified")
+    state.set_state("movies_modified", "2022-01-03T00:00:00", sync=True)
+    # Без close: снимка нет, состояние только в журнале
+    assert not file_path.exists()
+
+    restored = open_storage(file_path)
+    assert restored.retrieve_state() == {
+        "movies_modified": "2022-01-03T00:00:00"
+    }
+    restored.close()
+    storage.close()
+
+
+def test_torn_last_record_skipped(file_path):
+    storage = open_storage(file_path)
+    storage.update_state("a", 1, {}, sync=True)
+    storage.update_state("b", 2, {}, sync=True)
+    journal_path = file_path.with_name("state.json.journal")
+    journal = journal_path.read_bytes()
+    journal_path.write_bytes(journal[:-5])
+
+    restored = open_storage(file_path)
+    assert restored.retrieve_state() == {"a": 1}
+    # Журнал перенесён в снимок, оборванная запись отрезана
+    assert json.loads(file_path.read_text()) == {"a": 1}
+    assert journal_path.read_bytes() == b""
+    restored.close()
+    storage.close()
+
+
+def test_compact_keeps_records_written_after_snapshot(file_path):
+    storage = open_storage(file_path)
+    storage.update_state("a", {"nested": [1, 2]}, {})
+    storage.compact()
+    storage.update_state("b", "после снимка", {})
+
+    assert json.loads(file_path.read_text()) == {"a": {"nested": [1, 2]}}
+    restored = open_storage(file_path)
+    assert restored.retrieve_state() == {
+        "a": {"nested": [1, 2]},
+        "b": "после снимка",
+    }
+    restored.close()
+    storage.close()
+
+
+def test_background_compaction_by_threshold(file_path):
+    storage = open_storage(
+        file_path, fsync_interval=0.01, compact_threshold=64
+    )
+    for value in range(10):
+        storage.update_state("key", value, {})
+    journal_path = file_path.with_name("state.json.journal")
+    deadline = time.monotonic() + 5
+    while not file_path.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # Снимок записан фоновым потоком, до close
+    assert json.loads(file_path.read_text()) == {"key": 9}
+    assert journal_path.stat().st_size < 64
+    storage.close()
+
+
+def test_save_state_concurrent_with_compact(file_path):
+    storage = open_storage(file_path, fsync_interval=0)
+    errors = []
+
+    def save():
+        for value in range(200):
+            try:
+                storage.save_state({"saved": value})
+            except OSError as error:
+                errors.append(error)
+
+    def compact():
+        for value in range(200):
+            try:
+                storage.update_state("updated", value, {})
+                storage.compact()
+            except OSError as error:
+                errors.append(error)
+
+    threads = [threading.Thread(target=save), threading.Thread(target=compact)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    storage.close()
+
+    assert errors == []
+    restored = open_storage(file_path)
+    assert restored.retrieve_state() == storage.retrieve_state()
+    restored.close()
+
+
+@pytest.mark.parametrize("remove", [False, True])
+def test_write_synced_without_fsync_interval(file_path, remove):
+    storage = open_storage(file_path, fsync_interval=0)
+    storage.update_state("key", 1, {})
+    with mock.patch("components.storage.os.fsync", wraps=os.fsync) as fsync:
+        if remove:
+            storage.remove_state("key", {})
+        else:
+            storage.update_state("key", 2, {})
+    fsync.assert_called_once_with(storage._journal.fileno())
+    storage.close()
+
+
+def test_get_state_returns_copy(file_path):
+    storage = open_storage(file_path)
+    state = State(storage)
+    checkpoint = {"cursors": {"0": "a"}}
+    state.set_state("movies_shards", checkpoint)
+    checkpoint["cursors"]["0"] = "b"
+    state.get_state("movies_shards")["cursors"]["0"] = "c"
+
+    # Изменения мимо set_state не видны ни в памяти, ни после перезапуска
+    assert state.get_state("movies_shards") == {"cursors": {"0": "a"}}
+    storage.close()
+    restored = open_storage(file_path)
+    assert restored.retrieve_state() == {
+        "movies_shards": {"cursors": {"0": "a"}}
+    }
+    restored.close()
+
+
+def test_snapshot_rename_synced_before_journal_reset(file_path):
+    storage = open_storage(file_path)
+    storage.update_state("key", 1, {})
+    calls = []
+    with mock.patch(
+        "components.storage.fsync_directory",
+        side_effect=lambda path: calls.append(("directory", path)),
+    ), mock.patch(
+        "components.storage.os.replace",
+        side_effect=lambda source, target: (
+            calls.append(("replace", target)),
+            os.rename(source, target),
+        ),
+    ):
+        storage.compact()
+    journal_path = file_path.with_name("state.json.journal")
+    assert calls == [
+        ("replace", file_path),
+        ("directory", file_path.parent),
+        ("replace", journal_path),
+        ("directory", file_path.parent),
+    ]
+    storage.close()